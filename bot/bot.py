@@ -1,13 +1,20 @@
-from datetime import date, timedelta
 import os
+import time
 import random
 import asyncio
 import aiohttp
 from telethon import TelegramClient, events, functions, types, Button
-from telethon.errors import UserIsBlockedError, FloodWaitError
-import subprocess
 from dotenv import load_dotenv
-from db.database import User
+from db.database import Broadcast
+from core.scheduler import QueueFullError, PRIORITY_PREMIUM, PRIORITY_FREE
+from core import admission, broadcast, engine, payments, perf, qos, users
+from core.router import Router
+from core.pipeline import NoteJob, run_album
+from core.progress import ProgressReporter
+from core.ttlstore import TTLStore
+from core.subscriptions import expiry
+from core.fastlane import payment_lane
+from core.usage import usage, used_today
 
 load_dotenv()
 
@@ -22,28 +29,15 @@ if not API_ID or not BOT_TOKEN:
     raise ValueError("CRITICAL ERROR: .env file is missing or empty!")
 
 client = TelegramClient('bot_session_db', API_ID, API_HASH)
-ad_states = {}
-INVOICE_FILE = "processed_invoices.txt"
-
-
-async def register_user(event):
-    """Ensures user exists in DB on every interaction."""
-    sender = await event.get_sender()
-    uid = sender.id if sender else event.sender_id
-    user, _ = await User.get_or_create(
-        id=uid,
-        defaults={
-            'username': getattr(sender, 'username', None), 
-            'first_name': getattr(sender, 'first_name', 'User')
-        }
-    )
-    return user
+router = Router()
+# Broadcast drafts hold Message objects, so they stay in memory; abandoned ones expire
+ad_states = TTLStore('ad_drafts', ttl=3600, max_size=100, sliding=True)
+CACHE_OWNER = "bot"
+FREE_DAILY_LIMIT = 3
 
 
-@client.on(events.NewMessage(pattern='/start'))
-async def start_handler(event):
-    user = await register_user(event)
-    
+@router.route('/start', needs_user=True)
+async def start_handler(event, user):
     text = (
         f"✨ **Hello, {str(user.first_name).replace("@", "")}!**\n\n"
         "I create round video notes for you with saving of entered caption.\n"
@@ -59,11 +53,10 @@ async def start_handler(event):
     
     await event.respond(text, buttons=buttons)
 
-@client.on(events.CallbackQuery)
-async def menu_handler(event):
+@router.route('menu', needs_user=True)
+async def menu_handler(event, user):
     """Handles all button clicks."""
     data = event.data.decode('utf-8')
-    user = await register_user(event) 
     sender_id = event.sender_id
 
     if data == "menu_main":
@@ -90,11 +83,7 @@ async def menu_handler(event):
         await event.edit(text, buttons=buttons)
 
     elif data == "menu_premium":
-        is_active = (
-            user.is_premium and 
-            user.premium_expiry_date and 
-            user.premium_expiry_date >= date.today()
-        )
+        is_active = users.has_active_subscription(user)
 
         if is_active:
             expiry_str = user.premium_expiry_date.strftime("%Y-%m-%d")
@@ -107,10 +96,6 @@ async def menu_handler(event):
             buttons = [[Button.inline("🔙 Back", data=b"menu_main")]]
             await event.edit(text, buttons=buttons)
         else:
-            if user.is_premium:
-                user.is_premium = False
-                await user.save()
-                
             text = (
                 "💎 **Premium Subscription**\n\n"
                 "✅ Unlimited daily video conversions\n"
@@ -155,179 +140,179 @@ async def menu_handler(event):
             await event.respond(f"Error creating Stars invoice: {e}")
 
 
-def process_video_v2(input_path, output_path):
-    command = [
-        'ffmpeg', '-y', '-i', input_path,
-        '-vf', "crop='min(iw,ih):min(iw,ih)',scale=400:400",
-        '-c:v', 'libx264', '-preset', 'medium', '-crf', '20',
-        '-c:a', 'aac', '-b:a', '64k', '-movflags', '+faststart',
-        output_path
-    ]
-    try:
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return True
-    except Exception as e:
-        print(f"FFmpeg Error: {e}")
-        return False
-
-@client.on(events.NewMessage)
-async def video_handler(event):
-
-    if event.sender_id in ad_states:
-        return
-
-    if event.text and event.text.startswith('/') or not event.video or not event.is_private:
-        return
-
-    user = await register_user(event)
-    today = date.today()
-
-    if user.last_use_date != today:
-        user.done_today = 0
-        user.last_use_date = today
-        await user.save()
+@router.route('video', needs_user=True)
+async def video_handler(event, user):
 
-    is_subscription_active = (
-        user.is_premium and 
-        user.premium_expiry_date and 
-        user.premium_expiry_date >= date.today()
-    )
-    
-    if not is_subscription_active and user.is_premium:
-        user.is_premium = False
-        await user.save()
+    is_subscription_active = users.has_active_subscription(user)
 
-    if not is_subscription_active and user.done_today >= 3:
+    if not is_subscription_active and used_today(user) >= FREE_DAILY_LIMIT:
         await event.respond(
             "🚫 **Daily Limit Reached!**\n\nYou have used your 3 free videos for today.",
             buttons=[Button.inline("💎 Upgrade to Premium", data=b"menu_premium")]
         )
         return
 
-    duration = 0
-    if hasattr(event.video, 'attributes'):
-        for attr in event.video.attributes:
-            if isinstance(attr, types.DocumentAttributeVideo):
-                duration = attr.duration
-                break
-    
-    if duration > 60:
-        return await event.respond("❌ **Video is too long!** Maximum length for round notes is 60 seconds.")
+    decision = admission.check(event.video, is_subscription_active)
+    if not decision.accepted:
+        return await event.respond(decision.message)
+    duration = decision.duration
 
-    status_msg = await event.respond("⏳ **Processing...**")
-    
-    path_in = f"in_{event.id}_{random.randint(100,999)}.mp4"
-    path_out = f"out_{event.id}_{random.randint(100,999)}.mp4"
+    priority = PRIORITY_PREMIUM if is_subscription_active else PRIORITY_FREE
+    profile = engine.profile_for(is_subscription_active, decision.downscale)
+    progress = ProgressReporter(event, "⏳ **Processing...**", duration)
+    job = NoteJob(client, CACHE_OWNER, user.id, event.message, decision, profile, priority, progress)
 
     try:
-        await event.download_media(file=path_in)
-        await status_msg.edit("⚙️ **Cropping...**")
-        
-        success = await asyncio.to_thread(process_video_v2, path_in, path_out)
-        
-        if not success or not os.path.exists(path_out):
-            raise Exception("FFmpeg processing failed.")
-        
-        await status_msg.edit("⬆️ **Uploading...**")
-        uploaded_file = await client.upload_file(path_out)
+        peer = await event.get_input_chat()
+        await job.prepare()
+        await job.send(peer)
+
+        if not is_subscription_active:
+            await send_free_tip(peer)
+
+        usage.record(user)
+        job.timer.outcome = 'ok'
+        await progress.finish()
+
+    except QueueFullError:
+        job.timer.outcome = 'busy'
+        await progress.fail("🚦 **Server is busy!** Please try again in a few minutes.")
+    except Exception as e:
+        await progress.fail(f"❌ **Error:** {str(e)}")
+    finally:
+        job.cleanup()
+        if not progress.closed:
+            await progress.finish()
+        await job.timer.save()
+
+@router.route('album', needs_user=True)
+async def album_handler(event, user):
+    """Videos sent as one album: one quota check, parallel encodes, replies in album order."""
+    messages = [message for message in event.messages if message.video]
+    is_subscription_active = users.has_active_subscription(user)
+
+    accepted, rejections = [], []
+    for message in messages:
+        decision = admission.check(message.video, is_subscription_active)
+        if decision.accepted:
+            accepted.append((message, decision))
+        elif decision.message not in rejections:
+            rejections.append(decision.message)
+    if rejections:
+        await event.respond("\n\n".join(rejections))
+    if not accepted:
+        return
 
-        video_attribute = types.DocumentAttributeVideo(
-            duration=duration, 
-            w=400, h=400, 
-            round_message=True 
+    # Quota only counts videos that passed admission
+    skipped = 0
+    if not is_subscription_active:
+        remaining = FREE_DAILY_LIMIT - used_today(user)
+        if remaining <= 0:
+            await event.respond(
+                "🚫 **Daily Limit Reached!**\n\nYou have used your 3 free videos for today.",
+                buttons=[Button.inline("💎 Upgrade to Premium", data=b"menu_premium")]
+            )
+            return
+        skipped = max(0, len(accepted) - remaining)
+        accepted = accepted[:remaining]
+
+    priority = PRIORITY_PREMIUM if is_subscription_active else PRIORITY_FREE
+    progress = ProgressReporter(event, "⏳ **Processing...**", count=len(accepted))
+    jobs = [
+        NoteJob(
+            client, CACHE_OWNER, user.id, message, decision,
+            engine.profile_for(is_subscription_active, decision.downscale), priority,
+            progress.item(i, decision.duration)
         )
+        for i, (message, decision) in enumerate(accepted)
+    ]
 
-        await client(functions.messages.SendMediaRequest(
-            peer=await event.get_input_chat(),
-            media=types.InputMediaUploadedDocument(
-                file=uploaded_file, mime_type='video/mp4', attributes=[video_attribute]
-            ),
-            message=event.message.message or "",
-            entities=event.message.entities,
-            random_id=random.randint(0, 2**63 - 1)
-        ))
+    try:
+        peer = await event.get_input_chat()
+        sent, busy, failed = await run_album(jobs, peer)
+        for _ in range(sent):
+            usage.record(user)
 
-        if not is_subscription_active:
-            await client(functions.messages.SendMessageRequest(
-                peer=await event.get_input_chat(),
-                message="💡 Result only visible on Telegram Mobile.",
-                random_id=random.randint(0, 2**63 - 1)
-            ))
+        if sent and not is_subscription_active:
+            await send_free_tip(peer)
 
-        user.done_today += 1
-        await user.save()
-        await status_msg.delete()
+        if busy:
+            await progress.fail(
+                f"🚦 **Server is busy!** {busy} of {len(jobs)} videos were not converted. Please try again in a few minutes."
+            )
+        elif failed:
+            await progress.fail(f"❌ **Error:** {failed} of {len(jobs)} videos could not be converted.")
+        else:
+            await progress.finish()
 
-    except Exception as e:
-        await status_msg.edit(f"❌ **Error:** {str(e)}")
+        if skipped:
+            await event.respond(
+                f"🚫 **Daily Limit Reached!**\n\n{skipped} video(s) skipped, you have used your 3 free videos for today.",
+                buttons=[Button.inline("💎 Upgrade to Premium", data=b"menu_premium")]
+            )
     finally:
-        for p in [path_in, path_out]:
-            if os.path.exists(p):
-                try: os.remove(p)
-                except: pass
+        if not progress.closed:
+            await progress.finish()
+
+async def send_free_tip(peer):
+    await client(functions.messages.SendMessageRequest(
+        peer=peer,
+        message="💡 Result only visible on Telegram Mobile.",
+        random_id=random.randint(0, 2**63 - 1)
+    ))
 
-@client.on(events.Raw)
+@router.route('pre_checkout')
 async def pre_checkout_handler(event):
     """
     Approves the payment immediately when the user clicks 'Pay'.
+    Runs on the payment lane, answered over its own connection.
     """
-    if isinstance(event, types.UpdateBotPrecheckoutQuery):
-        try:
-            await client(functions.messages.SetBotPrecheckoutResultsRequest(
-                query_id=event.query_id,
-                success=True,
-                error=None
-            ))
-        except Exception as e:
-            print(f"Pre-checkout Error: {e}")
+    try:
+        await payment_lane.answer_precheckout(functions.messages.SetBotPrecheckoutResultsRequest(
+            query_id=event.query_id,
+            success=True,
+            error=None
+        ), event.received_at)
+    except Exception as e:
+        print(f"Pre-checkout Error: {e}")
 
-@client.on(events.Raw)
+@router.route('payment')
 async def raw_payment_handler(event):
     """
-    Catches the low-level 'UpdateNewMessage' to ensure we never miss a payment.
+    Routed from the low-level 'UpdateNewMessage' to ensure we never miss a payment.
     """
-    if isinstance(event, types.UpdateNewMessage):
-        message = event.message
-        
-        if isinstance(message, types.MessageService):
-            
-            if isinstance(message.action, types.MessageActionPaymentSentMe):
-                payment = message.action
-                
-                print(f"Payment Event Detected! Payload: {payment.payload}")
-                
-                try:
-                    payload = payment.payload.decode('utf-8')
-                    
-                    charge_id = None
-                    if hasattr(payment, 'charge') and payment.charge:
-                        charge_id = payment.charge.id
-
-                    if payload.startswith('premium_sub_'):
-                        user_id = int(payload.split('_')[-1])
-                        user = await User.get(id=user_id)
-                        
-                        user.is_premium = True
-                        user.premium_expiry_date = date.today() + timedelta(days=365)
-                        await user.save()
-                        
-                        await client.send_message(
-                            user_id,
-                            "🎉 **Payment Received!**\n\n"
-                            "You are now a Premium user for 1 Year.\n"
-                            "Thank you for your support!"
-                        )
-                        print(f"Premium activated for user {user_id}")
-
-                except Exception as e:
-                    print(f"CRITICAL ERROR in Payment Handler: {e}")
-
-
-@client.on(events.NewMessage(pattern='/broadcast'))
-async def start_broadcast_handler(event):
-    """Step 1: Admin starts the broadcast sequence."""
-    user = await register_user(event)
+    payment = event.message.action
+    
+    print(f"Payment Event Detected! Payload: {payment.payload}")
     
+    try:
+        payload = payment.payload.decode('utf-8')
+
+        if payload.startswith(payments.PREMIUM_PAYLOAD):
+            user_id = int(payload.split('_')[-1])
+            record = await payments.credit_premium(
+                user_id, payment.charge, payment.currency, payment.total_amount, payload
+            )
+            if record is None:
+                print(f"Duplicate charge {payment.charge.id} ignored")
+                return
+
+            user = await users.get_user(user_id)
+            await client.send_message(
+                users.input_peer(user_id, user.access_hash),
+                "🎉 **Payment Received!**\n\n"
+                f"You are now a Premium user until {record.expires_on.strftime('%Y-%m-%d')}.\n"
+                "Thank you for your support!"
+            )
+            print(f"Premium activated for user {user_id} until {record.expires_on}")
+
+    except Exception as e:
+        print(f"CRITICAL ERROR in Payment Handler: {e}")
+
+
+@router.route('/broadcast', needs_user=True)
+async def start_broadcast_handler(event, user):
+    """Step 1: Admin starts the broadcast sequence."""
     # Security: Check if sender is ADMIN
     if str(user.id) != str(ADMIN_ID):
         return # Ignore non-admins
@@ -352,24 +337,17 @@ async def start_broadcast_handler(event):
         "Send /cancel to stop."
     )
 
-@client.on(events.NewMessage(pattern='/cancel'))
+@router.route('/cancel')
 async def cancel_broadcast(event):
     sender_id = event.sender_id
     if sender_id in ad_states:
         del ad_states[sender_id]
         await event.respond("❌ Broadcast cancelled.")
 
-@client.on(events.NewMessage())
+@router.route('ad_builder')
 async def ad_builder_handler(event):
     """Handles the steps of building the ad (Content -> Button -> Target -> Confirm)."""
-    
-    # 1. Basic checks
-    if event.text and event.text.startswith('/') and event.text != '/next': 
-        return 
-        
     sender_id = event.sender_id
-    if sender_id not in ad_states: return
-
     state_data = ad_states[sender_id]
     current_state = state_data['state']
 
@@ -421,15 +399,18 @@ async def ad_builder_handler(event):
         text = event.text.strip()
         
         button = None
+        button_spec = None
         if text.lower() != 'skip':
             if '-' in text:
                 btn_text, btn_url = text.split('-', 1)
-                button = [Button.url(btn_text.strip(), btn_url.strip())]
+                button_spec = (btn_text.strip(), btn_url.strip())
+                button = [Button.url(*button_spec)]
             else:
                 await event.respond("⚠️ Format invalid. Use: `Text - URL` or send `skip`.")
                 return
 
         state_data['button'] = button
+        state_data['button_spec'] = button_spec
         
         # --- NEW STEP: Ask for Target Audience ---
         state_data['state'] = 'waiting_target'
@@ -487,7 +468,7 @@ async def ad_builder_handler(event):
             "Send **/cancel** to stop."
         )
 
-@client.on(events.NewMessage(pattern='/confirm_broadcast'))
+@router.route('/confirm_broadcast')
 async def execute_broadcast(event):
     """Step 5: Execute the sending loop."""
     sender_id = event.sender_id
@@ -501,78 +482,163 @@ async def execute_broadcast(event):
     
     status_msg = await event.respond(f"🚀 **Starting Broadcast ({target_audience.upper()})...**\nFetching users...")
 
-    # --- FILTER USERS BASED ON SELECTION ---
-    if target_audience == 'premium':
-        # Send ONLY to Premium
-        users = await User.filter(is_premium=True).all()
-    elif target_audience == 'all':
-        # Send to EVERYONE
-        users = await User.all()
-    else:
-        # Send ONLY to Non-Premium (Default)
-        users = await User.filter(is_premium=False).all()
-    
-    total = len(users)
-    sent = 0
-    blocked = 0
-    errors = 0
-    
-    await status_msg.edit(f"🚀 **Target:** {total} users ({target_audience}).\nSending in background...")
+    # Runs in the background with persistent per-recipient state, see core/broadcast.py
+    await broadcast.start_broadcast(
+        client,
+        admin_id=sender_id,
+        target=target_audience,
+        source_chat_id=event.chat_id,
+        message_ids=[m.id for m in data['content']],
+        button_spec=data.get('button_spec'),
+        status_msg=status_msg
+    )
 
-    # Helper to send (Handles Album vs Single logic)
-    async def send_ad(target_id):
-        msgs = data['content']
-        btn = data['button']
-        
-        if len(msgs) > 1: # Album
-            await client.send_message(target_id, file=[m.media for m in msgs], message=msgs[0].text)
-            if btn:
-                await client.send_message(target_id, "👇", buttons=btn)
-        else: # Single
-            msg = msgs[0]
-            await client.send_message(target_id, message=msg.text, file=msg.media, buttons=btn)
-
-    # Batch Processing
-    for i, user in enumerate(users):
-        try:
-            await send_ad(user.id)
-            sent += 1
-        except UserIsBlockedError:
-            blocked += 1
-        except FloodWaitError as e:
-            print(f"FloodWait: Sleeping {e.seconds}s")
-            await asyncio.sleep(e.seconds)
-            try:
-                await send_ad(user.id) # Retry once
-                sent += 1
-            except:
-                errors += 1
-        except Exception as e:
-            print(f"Failed to send to {user.id}: {e}")
-            errors += 1
-        
-        # Anti-Flood Delay: Sleep 1s every 20 messages
-        if i % 20 == 0 and i > 0:
-            await asyncio.sleep(1.5) 
-            # Update admin every 100 users
-            if i % 100 == 0:
-                await status_msg.edit(f"📊 Progress: {i}/{total}\n✅ Sent: {sent}\n🚫 Blocked: {blocked}")
-
-    await client.send_message(
-        sender_id,
-        f"✅ **Broadcast Complete!**\n\n"
-        f"🎯 Target: {target_audience.upper()}\n"
-        f"👥 Total Target: {total}\n"
-        f"✅ Successfully Sent: {sent}\n"
-        f"🚫 Blocked/Deleted: {blocked}\n"
-        f"⚠️ Errors: {errors}"
+@router.route('/pause_broadcast')
+async def pause_broadcast_handler(event):
+    if str(event.sender_id) != str(ADMIN_ID):
+        return
+
+    if not broadcast.runners:
+        return await event.respond("⚠️ No broadcast is running.")
+
+    for runner in broadcast.runners.values():
+        runner.pause()
+    await event.respond("⏸ Pausing after the current batch...")
+
+@router.route('/resume_broadcast')
+async def resume_broadcast_handler(event):
+    if str(event.sender_id) != str(ADMIN_ID):
+        return
+
+    paused = await Broadcast.filter(status='paused').order_by('-id').first()
+    if not paused:
+        return await event.respond("⚠️ No paused broadcast to resume.")
+
+    # Claim the row before any round-trip, so a second /resume_broadcast can't take it too
+    runner = await broadcast.resume_broadcast(client, paused)
+    if runner is None:
+        return await event.respond(f"⚠️ Broadcast #{paused.id} is already running.")
+    runner.status_msg = await event.respond(f"▶️ **Resuming broadcast #{paused.id}...**")
+
+@router.route('/revenue')
+async def revenue_handler(event):
+    if str(event.sender_id) != str(ADMIN_ID):
+        return
+
+    def lines(rows):
+        if not rows:
+            return "  —"
+        return "\n".join(f"  {r['currency']}: {r['total']} ({r['payments']} payments)" for r in rows)
+
+    await event.respond(
+        "💰 **Revenue**\n\n"
+        f"Last 30 days:\n{lines(await payments.revenue(days=30))}\n\n"
+        f"All time:\n{lines(await payments.revenue())}"
     )
 
+@router.route('/perf')
+async def perf_handler(event):
+    if str(event.sender_id) != str(ADMIN_ID):
+        return
+
+    args = (event.text or '').split()
+    hours = int(args[1]) if len(args) > 1 and args[1].isdigit() else 24
+    stages, outcomes, slowest = await perf.report(hours)
+
+    if not outcomes:
+        return await event.respond(f"📈 No jobs recorded in the last {hours}h.")
+
+    lines = [f"📈 **Performance, last {hours}h**", ""]
+    lines.append("Jobs: " + ", ".join(f"{name} {count}" for name, count in sorted(outcomes.items())))
+    lines.append("")
+    lines.append("`stage      n    p50    p95    p99`")
+    for name, (count, p50, p95, p99) in stages.items():
+        lines.append(f"`{name:<8}{count:>5}{p50:>7.2f}{p95:>7.2f}{p99:>7.2f}`")
+
+    tiers = await perf.slo(qos.LATENCY_TARGETS, hours)
+    if tiers:
+        lines.append("")
+        lines.append("**Latency targets:**")
+        for tier, (jobs, within, levels) in sorted(tiers.items()):
+            spread = ", ".join(f"L{level} {count}" for level, count in sorted(levels.items()))
+            lines.append(
+                f"• {tier}: {within}/{jobs} ({within / jobs:.0%}) within {qos.LATENCY_TARGETS[tier]:.0f}s"
+                f"{f' — {spread}' if spread else ''}"
+            )
+
+    lines.append("")
+    lines.append("**Slowest jobs:**")
+    for job in slowest:
+        size_mb = (job.input_size or 0) / (1024 * 1024)
+        lines.append(
+            f"• {job.total:.1f}s {job.outcome} — {job.source}, {job.path or '?'}"
+            f"{' (streamed)' if job.streamed else ''}, {size_mb:.1f}MB, "
+            f"{job.width or '?'}x{job.height or '?'}, {job.duration or '?'}s "
+            f"[{job.created_at.strftime('%m-%d %H:%M')}]"
+        )
+
+    await event.respond("\n".join(lines))
+
+def classify_message(event):
+    """Picks the single route for a new message; None means nobody handles it."""
+    text = event.text or ''
+    in_ad_builder = event.sender_id in ad_states
+
+    if text.startswith('/'):
+        command = text.split(maxsplit=1)[0].split('@')[0]
+        if command == '/next' and in_ad_builder:
+            return 'ad_builder'
+        return command
+
+    if in_ad_builder:
+        return 'ad_builder'
+    # Album videos arrive together through the Album event instead
+    if event.video and event.is_private and not event.grouped_id:
+        return 'video'
+    return None
+
+
+def classify_raw(update):
+    if isinstance(update, types.UpdateBotPrecheckoutQuery):
+        return 'pre_checkout'
+    message = update.message
+    if isinstance(message, types.MessageService) and isinstance(message.action, types.MessageActionPaymentSentMe):
+        return 'payment'
+    return None
+
+
+@client.on(events.NewMessage)
+async def message_router(event):
+    route = classify_message(event)
+    if route:
+        await router.dispatch(route, event)
+
+@client.on(events.Album)
+async def album_router(event):
+    if event.is_private and event.sender_id not in ad_states and any(m.video for m in event.messages):
+        await router.dispatch('album', event)
+
+@client.on(events.CallbackQuery)
+async def callback_router(event):
+    await router.dispatch('menu', event)
+
+@client.on(events.Raw(types=[types.UpdateBotPrecheckoutQuery, types.UpdateNewMessage]))
+async def raw_router(update):
+    route = classify_raw(update)
+    if route:
+        # Payments skip the shared handlers entirely; the lane's workers are reserved for them
+        update.received_at = time.monotonic()
+        payment_lane.submit(router.dispatch, route, update)
+
 async def main():
     print("Initializing Database...")
     
     print("Starting Bot...")
     await client.start(bot_token=BOT_TOKEN)
+    await payment_lane.start(client, API_ID, API_HASH, BOT_TOKEN)
+    expiry.start(client)
+    await broadcast.resume_interrupted(client)
+    asyncio.create_task(users.backfill_access_hashes(client))
     
 
     print("Bot is running. Press Ctrl+C to stop.")
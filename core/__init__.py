@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Core modules read their settings at import time, before bot/userbot get to call it
+load_dotenv()
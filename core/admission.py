@@ -0,0 +1,101 @@
+import os
+from dataclasses import dataclass
+from telethon import types
+from core.metrics import counter
+
+MB = 1024 * 1024
+
+ALLOWED_MIME_TYPES = {
+    'video/mp4', 'video/quicktime', 'video/webm', 'video/x-matroska',
+    'video/3gpp', 'video/mpeg', 'video/mp2t'
+}
+
+# Inputs bigger than this on their long side go to the cheap profile
+DOWNSCALE_SIDE = int(os.getenv('DOWNSCALE_SIDE') or 1920)
+
+rejections = counter('admission_rejections_total', 'Videos refused before download, by reason')
+
+
+@dataclass(frozen=True)
+class TierLimits:
+    max_bytes: int
+    max_duration: int
+    max_side: int
+
+
+LIMITS = {
+    'free': TierLimits(
+        max_bytes=int(os.getenv('FREE_MAX_MB') or 50) * MB,
+        max_duration=int(os.getenv('FREE_MAX_DURATION') or 60),
+        max_side=int(os.getenv('FREE_MAX_SIDE') or 2160),
+    ),
+    'premium': TierLimits(
+        max_bytes=int(os.getenv('PREMIUM_MAX_MB') or 200) * MB,
+        max_duration=int(os.getenv('PREMIUM_MAX_DURATION') or 60),
+        max_side=int(os.getenv('PREMIUM_MAX_SIDE') or 4096),
+    ),
+}
+
+REJECT_MESSAGES = {
+    'mime': "❌ **Unsupported format!** Please send an MP4, MOV, WebM or MKV video.",
+    'size': "❌ **File is too big!** Maximum size is {limit} MB.",
+    'duration': "❌ **Video is too long!** Maximum length for round notes is {limit} seconds.",
+    'resolution': "❌ **Resolution is too high!** Maximum is {limit}px on the long side.",
+    'metadata': "❌ **Can't read this video's length!** Please send it as a video, not as a file.",
+}
+
+
+@dataclass
+class Admission:
+    accepted: bool
+    reason: str = None
+    message: str = None
+    duration: float = 0
+    width: int = 0
+    height: int = 0
+    downscale: bool = False
+
+
+def video_attribute(document):
+    for attr in getattr(document, 'attributes', []):
+        if isinstance(attr, types.DocumentAttributeVideo):
+            return attr
+    return None
+
+
+def reject(reason, limit, attr):
+    rejections.inc(reason=reason)
+    return Admission(
+        False, reason,
+        REJECT_MESSAGES[reason].format(limit=limit),
+        duration=getattr(attr, 'duration', 0),
+        width=getattr(attr, 'w', 0),
+        height=getattr(attr, 'h', 0)
+    )
+
+
+def check(document, is_premium):
+    """Decides from the document metadata alone whether a video is worth downloading."""
+    limits = LIMITS['premium' if is_premium else 'free']
+    attr = video_attribute(document)
+
+    if (document.mime_type or '').lower() not in ALLOWED_MIME_TYPES:
+        return reject('mime', None, attr)
+    if document.size > limits.max_bytes:
+        return reject('size', limits.max_bytes // MB, attr)
+    if attr is None:
+        # Without a duration the length limit can't be enforced before download
+        return reject('metadata', None, attr)
+
+    if attr.duration > limits.max_duration:
+        return reject('duration', limits.max_duration, attr)
+    if max(attr.w, attr.h) > limits.max_side:
+        return reject('resolution', limits.max_side, attr)
+
+    return Admission(
+        True,
+        duration=attr.duration,
+        width=attr.w,
+        height=attr.h,
+        downscale=max(attr.w, attr.h) > DOWNSCALE_SIDE
+    )
@@ -0,0 +1,442 @@
+import os
+import time
+import random
+import asyncio
+import secrets
+from datetime import date
+from telethon import Button, functions, types, utils
+from telethon.errors import (
+    UserIsBlockedError, FloodWaitError, InputUserDeactivatedError, PeerIdInvalidError,
+    FileReferenceExpiredError
+)
+from tortoise import timezone
+from tortoise.expressions import Q
+from db.database import User, Broadcast, BroadcastDelivery
+from core.metrics import counter, histogram
+
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY') or 8)
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE') or 25)  # messages per second
+BROADCAST_BATCH = 200
+STATUS_INTERVAL = 10
+MAX_ATTEMPTS = 3
+
+flood_wait_seconds = counter('flood_wait_seconds_total', 'Seconds of FloodWait received, by source')
+broadcast_messages = counter('broadcast_messages_total', 'Broadcast deliveries, by result')
+send_latency = histogram('broadcast_send_seconds', 'API time spent delivering a broadcast to one recipient')
+
+# Running broadcasts by id, so admin commands can reach them
+runners = {}
+
+
+class TokenBucket:
+    """
+    Global send rate limiter. A FloodWait stalls every sender for the
+    requested time and halves the rate; successes slowly win it back.
+    """
+
+    def __init__(self, rate, min_rate=1.0):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+
+    def reward(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+bucket = TokenBucket(BROADCAST_RATE)
+
+
+class FloodLane:
+    """
+    The client as rate-limited senders see it: same connection and session,
+    but Telethon never sleeps through a FloodWait, so every one reaches the
+    bucket. Neither client(request, flood_sleep_threshold=0) nor _call() is
+    enough on its own: __call__ drops the argument, and _call compares the
+    server's FloodWait with the client's attribute rather than the argument.
+    """
+    flood_sleep_threshold = 0
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    async def __call__(self, request):
+        return await type(self._client)._call(self, self._client._sender, request, flood_sleep_threshold=0)
+
+
+def audience_query(target):
+    """Premium is decided by premium_expiry_date in SQL; is_premium only catches up on the next expiry sweep."""
+    today = date.today()
+    if target == 'premium':
+        return User.filter(premium_expiry_date__gte=today)
+    if target == 'all':
+        return User.all()
+    return User.filter(Q(premium_expiry_date__isnull=True) | Q(premium_expiry_date__lt=today))
+
+
+async def iter_audience(target, after_id=0, batch_size=BROADCAST_BATCH):
+    """Keyset-paginated (id, access_hash) pages, so memory stays flat whatever the audience size."""
+    while True:
+        rows = await audience_query(target).filter(id__gt=after_id) \
+            .order_by('id').limit(batch_size).values_list('id', 'access_hash')
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+
+class PreparedContent:
+    """
+    Broadcast content turned into raw requests once, before the loop.
+    The media are referenced by the ids Telegram already has, so nothing
+    is uploaded or converted per recipient; only peer and random_id change.
+    """
+
+    def __init__(self, client, msgs, button):
+        self.markup = client.build_reply_markup(button) if button else None
+        self.items = [
+            (self._input_media(m), m.message or "", m.entities)
+            for m in msgs
+        ]
+        # Same shape for every recipient, so one measurement is enough
+        self.request_bytes = sum(len(bytes(r)) for r in self.requests(types.InputPeerEmpty()))
+
+    @staticmethod
+    def _input_media(msg):
+        if msg.media is None or isinstance(msg.media, types.MessageMediaWebPage):
+            return None
+        return utils.get_input_media(msg.media)
+
+    def requests(self, peer):
+        if len(self.items) > 1:
+            # Media groups can't carry a keyboard, so the button needs its own message
+            album = [
+                types.InputSingleMedia(media=media, random_id=random_id(), message=text, entities=entities)
+                for media, text, entities in self.items
+            ]
+            yield functions.messages.SendMultiMediaRequest(peer=peer, multi_media=album)
+            if self.markup:
+                yield functions.messages.SendMessageRequest(
+                    peer=peer, message="👇", reply_markup=self.markup, random_id=random_id()
+                )
+            return
+
+        media, text, entities = self.items[0]
+        if media is None:
+            yield functions.messages.SendMessageRequest(
+                peer=peer, message=text, entities=entities,
+                reply_markup=self.markup, random_id=random_id()
+            )
+        else:
+            yield functions.messages.SendMediaRequest(
+                peer=peer, media=media, message=text, entities=entities,
+                reply_markup=self.markup, random_id=random_id()
+            )
+
+
+def random_id():
+    return random.randint(0, 2**63 - 1)
+
+
+async def load_content(client, broadcast):
+    msgs = await client.get_messages(broadcast.source_chat_id, ids=broadcast.message_ids)
+    msgs = [m for m in msgs if m]
+    if not msgs:
+        return None
+    button = [Button.url(broadcast.button_text, broadcast.button_url)] if broadcast.button_text else None
+    return PreparedContent(client, msgs, button)
+
+
+class BroadcastRunner:
+    def __init__(self, client, broadcast, status_msg=None):
+        self.client = client
+        self.lane = FloodLane(client)
+        self.broadcast = broadcast
+        self.status_msg = status_msg
+        self.paused = False
+        self.started = time.monotonic()
+        self.delivered = 0  # This run only, for throughput
+        self.sent = 0  # This run only, to go with latency_total
+        # Rows this runner has claimed carry its own status, so no other runner can take them
+        self.claim = f"sending:{secrets.token_hex(4)}"
+        self.content = None
+        self._refresh_lock = asyncio.Lock()
+        self.latency_total = 0.0
+        self.bytes_total = 0
+
+    def pause(self):
+        self.paused = True
+
+    def progress_text(self):
+        b = self.broadcast
+        done = b.sent + b.blocked + b.errors
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = self.delivered / elapsed
+        if rate > 0:
+            eta_seconds = int((b.total - done) / rate)
+            eta = f"{eta_seconds // 3600}h {eta_seconds % 3600 // 60:02d}m {eta_seconds % 60:02d}s"
+        else:
+            eta = "—"
+        return (
+            f"📊 **Broadcast #{b.id}** ({b.target.upper()})\n"
+            f"Progress: {done}/{b.total}\n"
+            f"✅ Sent: {b.sent}\n"
+            f"🚫 Blocked: {b.blocked}\n"
+            f"⚠️ Errors: {b.errors}\n"
+            f"⚡ {rate:.1f} msg/s · ⏳ ETA: {eta}"
+        )
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL)
+            if self.status_msg:
+                try:
+                    await self.status_msg.edit(self.progress_text())
+                except Exception as e:
+                    print(f"Broadcast status edit failed: {e}")
+
+    async def _refresh_content(self, stale):
+        """File references expire during long runs; reload them once for all senders."""
+        async with self._refresh_lock:
+            if self.content is stale:
+                self.content = await load_content(self.client, self.broadcast) or stale
+
+    async def _send(self, user_id, access_hash):
+        parts_sent = 0  # An album that went out before a FloodWait on its button isn't resent
+        latency = 0.0
+        for _ in range(MAX_ATTEMPTS):
+            await bucket.acquire()
+            content = self.content
+            try:
+                if access_hash:
+                    peer = types.InputPeerUser(user_id, access_hash)
+                else:
+                    peer = await self.client.get_input_entity(user_id)
+                for i, request in enumerate(content.requests(peer)):
+                    if i < parts_sent:
+                        continue
+                    started = time.monotonic()
+                    await self.lane(request)
+                    latency += time.monotonic() - started
+                    parts_sent += 1
+                bucket.reward()
+                send_latency.observe(latency)
+                self.latency_total += latency
+                self.bytes_total += content.request_bytes
+                return 'sent'
+            except FloodWaitError as e:
+                print(f"FloodWait: pausing broadcast senders for {e.seconds}s")
+                flood_wait_seconds.inc(e.seconds, source='broadcast')
+                bucket.penalize(e.seconds)
+            except FileReferenceExpiredError:
+                await self._refresh_content(content)
+            except (UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError):
+                return 'blocked'
+            except Exception as e:
+                print(f"Failed to send to {user_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+    async def _deliver(self, semaphore, delivery_id, user_id, access_hash):
+        async with semaphore:
+            # Rows stay 'pending' once paused; the next run's sweep picks them up
+            if self.paused:
+                return
+            # Claimed right before sending, so a crash leaves at most
+            # BROADCAST_CONCURRENCY rows in doubt, and only one runner gets each
+            claimed = await BroadcastDelivery.filter(id=delivery_id, status='pending').update(status=self.claim)
+            if not claimed:
+                return
+            status = await self._send(user_id, access_hash)
+            await BroadcastDelivery.filter(id=delivery_id).update(status=status)
+
+        b = self.broadcast
+        if status == 'sent':
+            b.sent += 1
+            self.sent += 1
+        elif status == 'blocked':
+            b.blocked += 1
+        else:
+            b.errors += 1
+        self.delivered += 1
+        broadcast_messages.inc(result=status)
+
+    async def _deliver_all(self, semaphore, rows):
+        """Delivers (delivery_id, user_id, access_hash) rows and saves the counters."""
+        tasks = [asyncio.create_task(self._deliver(semaphore, *row)) for row in rows]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # One failure stops the page; the rest must not keep sending behind the pause
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.broadcast.save(update_fields=['sent', 'blocked', 'errors'])
+
+    async def _pending_rows(self, after_id):
+        """A page of rows an earlier run recorded but never claimed (paused, or stopped by an error)."""
+        rows = await BroadcastDelivery.filter(broadcast_id=self.broadcast.id, status='pending', id__gt=after_id) \
+            .order_by('id').limit(BROADCAST_BATCH).values_list('id', 'user_id')
+        access_hashes = dict(await User.filter(id__in=[user_id for _, user_id in rows]).values_list('id', 'access_hash'))
+        return [(delivery_id, user_id, access_hashes.get(user_id)) for delivery_id, user_id in rows]
+
+    async def _run_batches(self):
+        b = self.broadcast
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+        after_id = 0
+        while True:
+            rows = await self._pending_rows(after_id)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            await self._deliver_all(semaphore, rows)
+            if self.paused:
+                return False
+
+        async for page in iter_audience(b.target, after_id=b.cursor):
+            # Recorded as 'pending' before the cursor moves past them; the
+            # conflict on (broadcast, user_id) keeps anyone from being recorded,
+            # and so sent, twice
+            access_hashes = dict(page)
+            await BroadcastDelivery.bulk_create(
+                [BroadcastDelivery(broadcast_id=b.id, user_id=uid, status='pending') for uid in access_hashes],
+                ignore_conflicts=True
+            )
+            b.cursor = page[-1][0]
+            await b.save(update_fields=['cursor'])
+
+            rows = await BroadcastDelivery.filter(broadcast_id=b.id, user_id__in=list(access_hashes), status='pending') \
+                .values_list('id', 'user_id')
+            await self._deliver_all(semaphore, [
+                (delivery_id, user_id, access_hashes[user_id]) for delivery_id, user_id in rows
+            ])
+
+            if self.paused:
+                return False
+
+        return True
+
+    async def run(self):
+        b = self.broadcast
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            self.content = await load_content(self.client, b)
+            if self.content is None:
+                b.status = 'cancelled'
+                await b.save(update_fields=['status'])
+                await self.client.send_message(b.admin_id, f"⚠️ Broadcast #{b.id} cancelled: its content was deleted.")
+                return
+
+            finished = await self._run_batches()
+        except Exception as e:
+            print(f"Broadcast #{b.id} crashed: {e}")
+            # Rows that were mid-send may or may not have gone out
+            await BroadcastDelivery.filter(broadcast_id=b.id, status=self.claim).update(status='unknown')
+            b.status = 'paused'
+            await b.save(update_fields=['status'])
+            await self.client.send_message(b.admin_id, f"⚠️ Broadcast #{b.id} paused after an error: {e}\nSend /resume_broadcast to continue.")
+            return
+        finally:
+            reporter.cancel()
+            runners.pop(b.id, None)
+
+        if not finished:
+            b.status = 'paused'
+            await b.save(update_fields=['status'])
+            await self.client.send_message(
+                b.admin_id,
+                f"⏸ **Broadcast #{b.id} paused.**\n\n{self.progress_text()}\n\nSend /resume_broadcast to continue."
+            )
+            return
+
+        b.status = 'done'
+        b.finished_at = timezone.now()
+        await b.save(update_fields=['status', 'finished_at'])
+        await self.client.send_message(
+            b.admin_id,
+            f"✅ **Broadcast Complete!**\n\n"
+            f"🎯 Target: {b.target.upper()}\n"
+            f"👥 Total Target: {b.total}\n"
+            f"✅ Successfully Sent: {b.sent}\n"
+            f"🚫 Blocked/Deleted: {b.blocked}\n"
+            f"⚠️ Errors: {b.errors}\n\n"
+            f"📦 Request size: {self.content.request_bytes} bytes per recipient\n"
+            f"⏱ Avg API latency: {self.latency_total / max(self.sent, 1) * 1000:.0f} ms per recipient"
+        )
+
+
+def launch(client, broadcast, status_msg=None):
+    runner = BroadcastRunner(client, broadcast, status_msg)
+    # Registered before the task starts, so a second resume sees it right away
+    runners[broadcast.id] = runner
+    runner.task = asyncio.create_task(runner.run())
+    return runner
+
+
+async def start_broadcast(client, admin_id, target, source_chat_id, message_ids, button_spec, status_msg):
+    button_text, button_url = button_spec or (None, None)
+    broadcast = await Broadcast.create(
+        admin_id=admin_id,
+        target=target,
+        source_chat_id=source_chat_id,
+        message_ids=message_ids,
+        button_text=button_text,
+        button_url=button_url
+    )
+
+    # A COUNT for the ETA; recipients themselves are streamed page by page
+    broadcast.total = await audience_query(target).count()
+    await broadcast.save(update_fields=['total'])
+
+    await status_msg.edit(f"🚀 **Target:** {broadcast.total} users ({target}).\nSending in background...")
+    return launch(client, broadcast, status_msg)
+
+
+async def resume_broadcast(client, broadcast, status_msg=None):
+    """
+    Moves a paused broadcast back to running and launches it; None when
+    it is already running or another resume got to it first.
+    """
+    if broadcast.id in runners:
+        return None
+    claimed = await Broadcast.filter(id=broadcast.id, status='paused').update(status='running')
+    if not claimed or broadcast.id in runners:
+        return None
+    broadcast.status = 'running'
+    return launch(client, broadcast, status_msg)
+
+
+async def resume_interrupted(client):
+    """Called on startup: picks up broadcasts that were running when the process died."""
+    await BroadcastDelivery.filter(status__startswith='sending').update(status='unknown')
+    for broadcast in await Broadcast.filter(status='running'):
+        status_msg = await client.send_message(broadcast.admin_id, f"🔄 Resuming broadcast #{broadcast.id} after restart...")
+        launch(client, broadcast, status_msg)
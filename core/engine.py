@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import asyncio
+import subprocess
+from dataclasses import dataclass
+from core.scheduler import TRANSCODE_WORKERS
+from core.governor import FFmpegRun
+
+NOTE_SIZE = 400
+
+# Split the cores between the scheduler's workers unless told otherwise
+FFMPEG_THREADS = int(os.getenv('FFMPEG_THREADS') or 0) or max(1, (os.cpu_count() or 2) // TRANSCODE_WORKERS)
+# Inputs above this size are re-encoded even when they could be copied
+REMUX_MAX_BYTES = int(os.getenv('REMUX_MAX_BYTES') or 8 * 1024 * 1024)
+
+# Processing paths, cheapest first
+PATH_REMUX = 'remux'
+PATH_COPY_VIDEO = 'copy_video'
+PATH_ENCODE = 'encode'
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    name: str
+    preset: str
+    crf: int
+    audio_bitrate: str = '64k'
+    maxrate: str = None
+    bufsize: str = None
+    threads: int = FFMPEG_THREADS
+    fps: int = None  # Output frame rate cap; None keeps the source rate
+
+
+PROFILES = {
+    'fast': EncodingProfile('fast', preset='veryfast', crf=26, audio_bitrate='48k', maxrate='800k', bufsize='1600k'),
+    'balanced': EncodingProfile('balanced', preset='faster', crf=23, maxrate='1500k', bufsize='3000k'),
+    'quality': EncodingProfile('quality', preset='medium', crf=20),
+}
+
+FREE_PROFILE = os.getenv('FREE_PROFILE') or 'fast'
+PREMIUM_PROFILE = os.getenv('PREMIUM_PROFILE') or 'quality'
+
+
+@dataclass
+class MediaInfo:
+    width: int = 0
+    height: int = 0
+    video_codec: str = None
+    pix_fmt: str = None
+    rotated: bool = False
+    audio_codec: str = None
+    fps: float = 0.0
+
+
+@dataclass
+class EncodeResult:
+    success: bool
+    profile: str
+    path: str = PATH_ENCODE
+    encode_time: float = 0.0
+    output_size: int = 0
+    note_size: int = NOTE_SIZE
+    data: bytes = None  # Set by the streaming path, which never writes a file
+
+
+def profile_for(is_premium, downscale=False):
+    """Oversized inputs (see admission.DOWNSCALE_SIDE) always get the cheap profile."""
+    if downscale:
+        return PROFILES['fast']
+    return PROFILES[PREMIUM_PROFILE if is_premium else FREE_PROFILE]
+
+
+PROBE_COMMAND = [
+    'ffprobe', '-v', 'error', '-print_format', 'json',
+    '-show_entries', 'stream=codec_type,codec_name,width,height,pix_fmt,avg_frame_rate:stream_tags=rotate:stream_side_data=rotation',
+]
+
+
+def parse_rate(rate):
+    """ffprobe's '30000/1001' style rate as a float; 0.0 when unknown."""
+    numerator, _, denominator = str(rate or '').partition('/')
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def parse_probe(raw):
+    try:
+        streams = json.loads(raw).get('streams', [])
+    except (ValueError, AttributeError):
+        return None
+
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        return None
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    rotation = video.get('tags', {}).get('rotate', 0)
+    for side_data in video.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+
+    return MediaInfo(
+        width=video.get('width', 0),
+        height=video.get('height', 0),
+        video_codec=video.get('codec_name'),
+        pix_fmt=video.get('pix_fmt'),
+        rotated=int(float(rotation or 0)) % 360 != 0,
+        audio_codec=audio.get('codec_name') if audio else None,
+        fps=parse_rate(video.get('avg_frame_rate'))
+    )
+
+
+async def probe_file(path):
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *PROBE_COMMAND, path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=30)
+    except asyncio.TimeoutError:
+        print(f"FFprobe Error: timed out on {path}")
+        process.kill()
+        await process.wait()
+        return None
+    except Exception as e:
+        print(f"FFprobe Error: {e}")
+        return None
+    return parse_probe(stdout)
+
+
+async def probe_bytes(data):
+    """Probes the head of a download; moov-first MP4s carry all stream info up front."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *PROBE_COMMAND, 'pipe:0',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await asyncio.wait_for(process.communicate(data), timeout=30)
+    except asyncio.TimeoutError:
+        print("FFprobe Error: timed out on a download head")
+        process.kill()
+        await process.wait()
+        return None
+    except Exception as e:
+        print(f"FFprobe Error: {e}")
+        return None
+    return parse_probe(stdout)
+
+
+def choose_path(info, input_size):
+    """Picks the cheapest path that still yields a valid round note."""
+    if info is None or input_size > REMUX_MAX_BYTES:
+        return PATH_ENCODE
+    if info.video_codec != 'h264' or info.pix_fmt not in ('yuv420p', 'yuvj420p') or info.rotated:
+        return PATH_ENCODE
+    if info.width != info.height or info.width > NOTE_SIZE:
+        return PATH_ENCODE
+    if info.audio_codec in (None, 'aac'):
+        return PATH_REMUX
+    return PATH_COPY_VIDEO
+
+
+def video_filter(info, fps=None):
+    """
+    Only crop when the input isn't square and only scale when the side
+    differs. fps only ever lowers the frame rate, never pads it.
+    """
+    if info is None:
+        filters = ["crop='min(iw,ih):min(iw,ih)'", f"scale={NOTE_SIZE}:{NOTE_SIZE}"]
+    else:
+        filters = []
+        if info.width != info.height:
+            filters.append("crop='min(iw,ih):min(iw,ih)'")
+        if min(info.width, info.height) != NOTE_SIZE:
+            filters.append(f"scale={NOTE_SIZE}:{NOTE_SIZE}")
+    if fps and (info is None or not info.fps or info.fps > fps):
+        filters.append(f"fps={fps}")
+    return ','.join(filters)
+
+
+def build_command(profile, input_path, output_path, fragmented=False, info=None, path=PATH_ENCODE, progress=None):
+    """
+    Crop to the centre square and scale to a round note, or copy what is
+    already compatible. Fragmented output is for pipes, since +faststart
+    needs a seekable file. progress names the pipe for -progress output.
+    """
+    command = ['ffmpeg', '-y']
+    if path == PATH_ENCODE:
+        # Scaling runs on its own thread pool; keep it inside the same budget
+        command += ['-filter_threads', str(profile.threads)]
+    if progress:
+        command += ['-progress', progress, '-nostats']
+    command += ['-i', input_path, '-map', '0:v:0', '-map', '0:a:0?']
+
+    if path == PATH_ENCODE:
+        vf = video_filter(info, profile.fps)
+        if vf:
+            command += ['-vf', vf]
+        command += ['-c:v', 'libx264', '-preset', profile.preset, '-crf', str(profile.crf)]
+        if profile.maxrate:
+            command += ['-maxrate', profile.maxrate, '-bufsize', profile.bufsize or profile.maxrate]
+        command += ['-threads', str(profile.threads)]
+    else:
+        command += ['-c:v', 'copy']
+
+    if path == PATH_REMUX:
+        command += ['-c:a', 'copy']
+    else:
+        command += ['-c:a', 'aac', '-b:a', profile.audio_bitrate]
+
+    if fragmented:
+        command += ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+    else:
+        command += ['-movflags', '+faststart']
+    command.append(output_path)
+    return command
+
+
+def parse_progress(line):
+    """Output position in seconds from one '-progress' line, or None."""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', 'replace')
+    key, _, value = line.strip().partition('=')
+    # out_time_ms is in microseconds too, despite the name
+    if key in ('out_time_us', 'out_time_ms') and value.isdigit():
+        return int(value) / 1_000_000
+    return None
+
+
+def output_side(info, path):
+    return info.width if path != PATH_ENCODE else NOTE_SIZE
+
+
+def report(result, source):
+    if result.success:
+        print(
+            f"Processed {source} via {result.path} with '{result.profile}' "
+            f"in {result.encode_time:.2f}s -> {result.output_size} bytes"
+        )
+    else:
+        print(f"Processing {source} via {result.path} with '{result.profile}' failed after {result.encode_time:.2f}s")
+
+
+async def transcode_file(input_path, output_path, profile, on_progress=None):
+    """
+    File-to-file job, awaited on a scheduler worker under the resource
+    governor; cancelling the awaiting task kills ffmpeg.
+    on_progress(seconds) is called as ffmpeg advances.
+    """
+    started = time.monotonic()
+    info = await probe_file(input_path)
+    path = choose_path(info, os.path.getsize(input_path))
+    try:
+        command = build_command(profile, input_path, output_path, info=info, path=path, progress='pipe:1')
+        async with FFmpegRun(command, stdout=asyncio.subprocess.PIPE) as run:
+            async for line in run.process.stdout:
+                position = parse_progress(line)
+                if position is not None and on_progress:
+                    on_progress(position)
+            returncode = await run.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stderr=run.tail())
+        result = EncodeResult(
+            True, profile.name, path,
+            encode_time=time.monotonic() - started,
+            output_size=os.path.getsize(output_path),
+            note_size=output_side(info, path)
+        )
+    except Exception as e:
+        print(f"FFmpeg Error: {e}")
+        if getattr(e, 'stderr', None):
+            print(e.stderr)
+        result = EncodeResult(False, profile.name, path, encode_time=time.monotonic() - started)
+
+    report(result, input_path)
+    return result
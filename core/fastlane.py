@@ -0,0 +1,71 @@
+import os
+import time
+import asyncio
+from telethon import TelegramClient
+from core.metrics import histogram
+
+PAYMENT_LANE_WORKERS = int(os.getenv('PAYMENT_LANE_WORKERS') or 2)
+# Telegram drops the payment if the pre-checkout answer takes longer than this
+PRECHECKOUT_DEADLINE = 10
+# Kept on disk like the main bot_session_db, so restarts reuse the login
+# instead of importing a new bot authorization each time
+PAYMENT_LANE_SESSION = 'payment_lane_session_db'
+
+precheckout_latency = histogram(
+    'precheckout_answer_seconds',
+    'Time from receiving a pre-checkout query to answering it',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+)
+
+
+class FastLane:
+    """
+    Reserved capacity for payment updates.
+    Its workers never run anything else, and its requests go over a second
+    bot connection, so answers don't queue behind video upload parts on the
+    main sender.
+    """
+
+    def __init__(self, workers=PAYMENT_LANE_WORKERS):
+        self.workers = workers
+        self.client = None
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    async def start(self, main_client, api_id, api_hash, bot_token):
+        self.client = main_client
+        try:
+            # receive_updates=False: this session only sends, the main client keeps getting updates
+            dedicated = TelegramClient(PAYMENT_LANE_SESSION, api_id, api_hash, receive_updates=False)
+            await dedicated.start(bot_token=bot_token)
+            self.client = dedicated
+            print("✅ Payment lane connected")
+        except Exception as e:
+            print(f"Payment lane falling back to the main connection: {e}")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, handler, *args):
+        self._queue.put_nowait((handler, args))
+
+    async def _worker(self):
+        while True:
+            handler, args = await self._queue.get()
+            try:
+                await handler(*args)
+            except Exception as e:
+                print(f"Payment lane error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def answer_precheckout(self, request, received_at):
+        try:
+            return await self.client(request)
+        finally:
+            elapsed = time.monotonic() - received_at
+            precheckout_latency.observe(elapsed)
+            if elapsed > PRECHECKOUT_DEADLINE / 2:
+                print(f"⚠️ Pre-checkout answered in {elapsed:.2f}s (deadline {PRECHECKOUT_DEADLINE}s)")
+
+
+payment_lane = FastLane()
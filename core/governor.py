@@ -0,0 +1,139 @@
+import os
+import re
+import shutil
+import asyncio
+from collections import deque
+from core.metrics import counter
+
+# Wall-clock limit for one ffmpeg run; notes are at most a minute long
+FFMPEG_TIMEOUT = float(os.getenv('FFMPEG_TIMEOUT') or 300)
+# Added to ffmpeg's niceness so encodes never starve the bots' event loop
+FFMPEG_NICE = int(os.getenv('FFMPEG_NICE') or 10)
+# Address-space cap per ffmpeg process; 0 leaves it unlimited
+FFMPEG_MEMORY_MB = int(os.getenv('FFMPEG_MEMORY_MB') or 0)
+FFMPEG_STDERR_LINES = 40
+
+# '-progress' lines are bare key=value pairs; they'd crowd the diagnostics out
+PROGRESS_LINE = re.compile(rb'^\w+=\S*$')
+
+kills = counter('ffmpeg_killed_total', 'ffmpeg runs killed by the governor, by reason')
+
+_running = set()
+
+
+class FFmpegTimeout(Exception):
+    """Raised when an ffmpeg run outlives FFMPEG_TIMEOUT."""
+
+
+def limit_prefix():
+    """
+    nice / prlimit in front of ffmpeg. Both exec into it, so the pid stays
+    ffmpeg's, and no Python runs in the child between fork and exec (a
+    preexec_fn can deadlock there while aiosqlite and to_thread threads run).
+    """
+    prefix = []
+    if FFMPEG_NICE:
+        if shutil.which('nice'):
+            prefix += ['nice', '-n', str(FFMPEG_NICE)]
+        else:
+            print("⚠️ FFMPEG_NICE is set but nice is not installed")
+    if FFMPEG_MEMORY_MB:
+        if shutil.which('prlimit'):
+            prefix += ['prlimit', f'--as={FFMPEG_MEMORY_MB * 1024 * 1024}']
+        else:
+            print("⚠️ FFMPEG_MEMORY_MB is set but prlimit is not installed")
+    return prefix
+
+
+LIMIT_PREFIX = limit_prefix()
+
+
+class FFmpegRun:
+    """
+    One governed ffmpeg process: lowered priority and optional memory cap,
+    killed at FFMPEG_TIMEOUT, when the awaiting task is cancelled (the user
+    gave up, or shutdown), or by kill_all(). stderr is drained continuously
+    into a ring buffer of the last FFMPEG_STDERR_LINES lines; on_stderr,
+    when given, sees every line first (the streaming path reads -progress
+    there).
+
+        async with FFmpegRun(command, stdout=PIPE) as run:
+            ... read run.process.stdout ...
+            await run.wait()
+    """
+
+    def __init__(self, command, stdin=None, stdout=None, on_stderr=None, timeout=FFMPEG_TIMEOUT):
+        self.command = command
+        self.stdin = stdin
+        self.stdout = stdout
+        self.on_stderr = on_stderr
+        self.timeout = timeout
+        self.process = None
+        self.stderr = deque(maxlen=FFMPEG_STDERR_LINES)
+        self.timed_out = False
+        self._drain = None
+        self._deadline = None
+
+    async def __aenter__(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *LIMIT_PREFIX, *self.command,
+            stdin=self.stdin,
+            stdout=self.stdout,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _running.add(self)
+        self._drain = asyncio.create_task(self._read_stderr())
+        if self.timeout:
+            self._deadline = asyncio.get_running_loop().call_later(self.timeout, self._expire)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._deadline:
+            self._deadline.cancel()
+        if self.process.returncode is None:
+            self.kill('cancelled' if exc_type is asyncio.CancelledError else 'error')
+            # Reap it even while being cancelled, or it lingers as a zombie
+            await asyncio.shield(self.process.wait())
+        try:
+            await asyncio.shield(self._drain)
+        except Exception:
+            pass
+        _running.discard(self)
+
+    async def _read_stderr(self):
+        async for line in self.process.stderr:
+            if self.on_stderr:
+                self.on_stderr(line)
+            if not PROGRESS_LINE.match(line.strip()):
+                self.stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+    def _expire(self):
+        self.timed_out = True
+        self.kill('timeout')
+
+    def kill(self, reason):
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                return
+            kills.inc(reason=reason)
+
+    async def wait(self):
+        """Waits for exit; raises FFmpegTimeout if the deadline killed it."""
+        await self.process.wait()
+        await asyncio.shield(self._drain)
+        if self.timed_out:
+            print(f"FFmpeg killed after {self.timeout:.0f}s:\n{self.tail()}")
+            raise FFmpegTimeout(f"ffmpeg took longer than {self.timeout:.0f}s")
+        return self.process.returncode
+
+    def tail(self, lines=10):
+        return '\n'.join(list(self.stderr)[-lines:])
+
+
+def kill_all(reason='shutdown'):
+    """Kills every ffmpeg still running, for the shutdown path."""
+    for run in list(_running):
+        run.kill(reason)
+    return len(_running)
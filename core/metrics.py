@@ -0,0 +1,107 @@
+import threading
+
+REGISTRY = {}
+
+
+class Counter:
+    """Monotonic counter with optional labels, safe to bump from worker threads."""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def snapshot(self):
+        """Copy of the current values, keyed by tuples of (label, value) pairs."""
+        with self._lock:
+            return dict(self.values)
+
+
+def counter(name, documentation):
+    if name not in REGISTRY:
+        REGISTRY[name] = Counter(name, documentation)
+    return REGISTRY[name]
+
+
+class Gauge:
+    """Point-in-time value with optional labels; either set directly or read from a callback."""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.callbacks = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def track(self, func, **labels):
+        """Reads the value from func() whenever the gauge is collected."""
+        self.callbacks[tuple(sorted(labels.items()))] = func
+
+    def get(self, **labels):
+        key = tuple(sorted(labels.items()))
+        if key in self.callbacks:
+            return self.callbacks[key]()
+        return self.values.get(key, 0)
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self.values)
+        for key, func in list(self.callbacks.items()):
+            values[key] = func()
+        return values
+
+
+def gauge(name, documentation):
+    if name not in REGISTRY:
+        REGISTRY[name] = Gauge(name, documentation)
+    return REGISTRY[name]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, the shape Prometheus expects."""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def mean(self, **labels):
+        state = self.values.get(tuple(sorted(labels.items())))
+        return state[-2] / state[-1] if state and state[-1] else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(state) for key, state in self.values.items()}
+
+
+def histogram(name, documentation, buckets=Histogram.DEFAULT_BUCKETS):
+    if name not in REGISTRY:
+        REGISTRY[name] = Histogram(name, documentation, buckets)
+    return REGISTRY[name]
@@ -0,0 +1,138 @@
+import json
+import asyncio
+from core.metrics import REGISTRY, Counter, Gauge, Histogram
+
+READ_TIMEOUT = 10
+MAX_HEADER_LINES = 100
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Prometheus text exposition (version 0.0.4) of everything in the registry."""
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        if isinstance(metric, Counter):
+            kind = 'counter'
+        elif isinstance(metric, Gauge):
+            kind = 'gauge'
+        elif isinstance(metric, Histogram):
+            kind = 'histogram'
+        else:
+            continue
+
+        lines.append(f'# HELP {name} {escape(metric.documentation)}')
+        lines.append(f'# TYPE {name} {kind}')
+
+        for labels, value in sorted(metric.snapshot().items()):
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            # Bucket counts are already cumulative
+            for bound, count in zip(metric.buckets, value):
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", format_value(float(bound)))])} {count}')
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {value[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(float(value[-2]))}')
+            lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class MonitoringServer:
+    """
+    Minimal HTTP/1.1 server for the platform's port check and for scraping.
+      /         plain "I am up", what Render probes
+      /metrics  Prometheus text format
+      /healthz  JSON with each registered check; 503 if any is failing
+    """
+
+    def __init__(self):
+        self.checks = {}
+
+    def add_check(self, name, func):
+        """func() returns True when healthy; it may be a coroutine function."""
+        self.checks[name] = func
+
+    async def health(self):
+        results = {}
+        for name, func in self.checks.items():
+            try:
+                result = func()
+                if asyncio.iscoroutine(result):
+                    result = await result
+                results[name] = bool(result)
+            except Exception:
+                results[name] = False
+        return results
+
+    async def respond(self, path):
+        if path == '/metrics':
+            return 200, 'text/plain; version=0.0.4; charset=utf-8', render_metrics()
+        if path == '/healthz':
+            results = await self.health()
+            status = 200 if all(results.values()) else 503
+            return status, 'application/json', json.dumps({'ok': status == 200, 'checks': results})
+        if path == '/':
+            return 200, 'text/plain; charset=utf-8', 'I am up'
+        return 404, 'text/plain; charset=utf-8', 'Not Found'
+
+    async def handle_client(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            # Drain headers; nothing here needs them
+            for _ in range(MAX_HEADER_LINES):
+                line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                status, content_type, body = 400, 'text/plain; charset=utf-8', 'Bad Request'
+                method = 'GET'
+            else:
+                method, target = parts[0], parts[1]
+                if method not in ('GET', 'HEAD'):
+                    status, content_type, body = 405, 'text/plain; charset=utf-8', 'Method Not Allowed'
+                else:
+                    status, content_type, body = await self.respond(target.split('?', 1)[0])
+
+            payload = body.encode('utf-8')
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                      503: 'Service Unavailable'}[status]
+            writer.write(
+                f'HTTP/1.1 {status} {reason}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(payload)}\r\n'
+                'Connection: close\r\n\r\n'.encode('latin-1')
+            )
+            if method != 'HEAD':
+                writer.write(payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"✅ Monitoring server started on port {port}")
+        async with server:
+            await server.serve_forever()
+
+
+monitor = MonitoringServer()
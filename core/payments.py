@@ -0,0 +1,63 @@
+from datetime import date, timedelta
+from tortoise import timezone
+from tortoise.exceptions import IntegrityError
+from tortoise.functions import Count, Sum
+from tortoise.transactions import in_transaction
+from db.database import User, Payment
+from core import users
+
+PREMIUM_DAYS = 365
+PREMIUM_PAYLOAD = 'premium_sub_'
+
+
+async def credit_premium(user_id, charge, currency, amount, payload, days=PREMIUM_DAYS):
+    """
+    Records the charge and extends premium in one transaction.
+    Renewals stack on the current expiry. Returns the new Payment, or None
+    when this charge was already credited.
+    """
+    if await Payment.filter(charge_id=charge.id).exists():
+        return None
+
+    try:
+        async with in_transaction() as conn:
+            # Claim the charge first; a concurrent duplicate fails here and rolls back
+            payment = await Payment.create(
+                charge_id=charge.id,
+                provider_charge_id=charge.provider_charge_id or None,
+                user_id=user_id,
+                currency=currency,
+                amount=amount,
+                payload=payload,
+                days=days,
+                expires_on=date.today(),
+                using_db=conn
+            )
+
+            user = await User.select_for_update().using_db(conn).get_or_none(id=user_id)
+            if user is None:
+                user = await User.create(id=user_id, using_db=conn)
+
+            today = date.today()
+            current = user.premium_expiry_date
+            start = current if current and current >= today else today
+            user.is_premium = True
+            user.premium_expiry_date = start + timedelta(days=days)
+            await user.save(using_db=conn, update_fields=['is_premium', 'premium_expiry_date'])
+
+            payment.expires_on = user.premium_expiry_date
+            await payment.save(using_db=conn, update_fields=['expires_on'])
+    except IntegrityError:
+        return None
+
+    users.invalidate(user_id)
+    return payment
+
+
+async def revenue(days=None):
+    """Totals per currency from the payments table, optionally over the last N days."""
+    query = Payment.all()
+    if days is not None:
+        query = query.filter(created_at__gte=timezone.now() - timedelta(days=days))
+    return await query.annotate(total=Sum('amount'), payments=Count('id')) \
+        .group_by('currency').values('currency', 'total', 'payments')
@@ -0,0 +1,139 @@
+import os
+import math
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from tortoise import timezone
+from tortoise.functions import Count
+from db.database import JobRecord
+from core.metrics import counter, histogram
+
+JOB_RECORD_RETENTION_DAYS = int(os.getenv('JOB_RECORD_RETENTION_DAYS') or 14)
+PRUNE_INTERVAL = 3600
+
+STAGES = ('queue', 'download', 'stream', 'ffmpeg', 'upload', 'send')
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+stage_latency = histogram('job_stage_seconds', 'Time spent in each stage of a video job, by stage and source', STAGE_BUCKETS)
+media_bytes = counter('media_bytes_total', 'Media bytes downloaded and uploaded, by direction and source')
+
+_last_prune = 0.0
+
+
+class JobTimer:
+    """
+    Per-job stage timings; every stage also lands in the job_stage_seconds
+    histogram, and save() writes the whole job as one JobRecord row.
+    """
+
+    def __init__(self, source, user_id=None, **details):
+        self.source = source
+        self.user_id = user_id
+        self.details = details
+        self.started = time.monotonic()
+        self.stages = {}
+        self.path = None
+        self.streamed = False
+        self.output_size = None
+        self.outcome = 'failed'
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        stage_latency.observe(seconds, stage=stage, source=self.source)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def bytes_in(self, amount):
+        media_bytes.inc(amount or 0, direction='in', source=self.source)
+
+    def bytes_out(self, amount):
+        self.output_size = amount
+        media_bytes.inc(amount or 0, direction='out', source=self.source)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    async def save(self):
+        """Never raises: losing a perf row must not fail the job."""
+        try:
+            await JobRecord.create(
+                source=self.source,
+                user_id=self.user_id,
+                path=self.path,
+                streamed=self.streamed,
+                output_size=self.output_size,
+                outcome=self.outcome,
+                total=self.elapsed,
+                **{stage: self.stages.get(stage) for stage in STAGES},
+                **self.details
+            )
+            await prune()
+        except Exception as e:
+            print(f"Job record not saved: {e}")
+
+
+async def prune():
+    """Drops records past the retention window, at most once per PRUNE_INTERVAL."""
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune and now - _last_prune < PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    cutoff = timezone.now() - timedelta(days=JOB_RECORD_RETENTION_DAYS)
+    await JobRecord.filter(created_at__lt=cutoff).delete()
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = math.ceil(q / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+async def report(hours=24, slowest=5):
+    """Per-stage p50/p95/p99 and the slowest jobs over the last `hours`."""
+    since = timezone.now() - timedelta(hours=hours)
+    recent = JobRecord.filter(created_at__gte=since)
+
+    columns = STAGES + ('total',)
+    rows = await recent.filter(outcome='ok').values_list(*columns)
+    stages = {}
+    for i, name in enumerate(columns):
+        values = sorted(row[i] for row in rows if row[i] is not None)
+        if values:
+            stages[name] = (len(values), percentile(values, 50), percentile(values, 95), percentile(values, 99))
+
+    outcomes = {
+        row['outcome']: row['jobs']
+        for row in await recent.annotate(jobs=Count('id')).group_by('outcome').values('outcome', 'jobs')
+    }
+
+    slow = await recent.order_by('-total').limit(slowest)
+    return stages, outcomes, slow
+
+
+async def slo(targets, hours=24):
+    """
+    Per tier over the last `hours`: finished jobs, how many came in under
+    targets[tier] seconds, and how many ran at each QoS level.
+    """
+    since = timezone.now() - timedelta(hours=hours)
+    rows = await JobRecord.filter(
+        created_at__gte=since, outcome='ok', tier__isnull=False
+    ).values_list('tier', 'total', 'qos_level')
+
+    tiers = {}
+    for tier, total, level in rows:
+        jobs, within, levels = tiers.get(tier, (0, 0, {}))
+        if level is not None:
+            levels[level] = levels.get(level, 0) + 1
+        tiers[tier] = (jobs + 1, within + (total <= targets.get(tier, float('inf'))), levels)
+    return tiers
@@ -0,0 +1,168 @@
+import os
+import random
+import asyncio
+from telethon import functions, types
+from core import engine, qos, result_cache, transfer
+from core.perf import JobTimer
+from core.scheduler import transcoder, run_with_status, tier_name, QueueFullError
+from core.streaming import STREAM_TRANSCODE, fetch_head, stream_transcode
+
+
+class NoteJob:
+    """
+    One video on its way to a round note. prepare() does the expensive part
+    (cache lookup, or stream / download + ffmpeg, then upload) and can run
+    alongside other jobs; send() posts the note, so an album's replies can
+    go out in order whatever finished first.
+    """
+
+    def __init__(self, client, owner, user_id, message, decision, profile, priority, progress):
+        self.client = client
+        self.owner = owner
+        self.message = message
+        self.video = message.video
+        self.decision = decision
+        self.profile = profile
+        self.priority = priority
+        self.progress = progress
+        self.timer = JobTimer(
+            owner, user_id,
+            input_size=self.video.size, duration=decision.duration,
+            width=decision.width, height=decision.height, profile=profile.name,
+            tier=tier_name(priority)
+        )
+        self.path_in = f"in_{message.id}_{random.randint(1000,9999)}.mp4"
+        self.path_out = f"out_{message.id}_{random.randint(1000,9999)}.mp4"
+        self.cached = None
+        self.content_hash = None
+        self.result = None
+        self.uploaded_file = None
+
+    async def prepare(self):
+        # Forwarded clips keep their Document.id, so repeats skip the whole pipeline
+        self.cached = await result_cache.lookup(self.owner, source_id=self.video.id)
+        if self.cached is None:
+            await self._encode()
+
+    async def _encode(self, use_cache=True):
+        if transcoder.is_full():
+            raise QueueFullError("Transcode queue is full")
+
+        client, timer, progress = self.client, self.timer, self.progress
+        # Settings follow the load at submit time, which is what decides this job's wait
+        tuned = qos.controller.tune(self.profile, self.priority)
+        profile = tuned.profile
+        timer.details['qos_level'] = tuned.level
+
+        video_data = None
+        # Unstreamable inputs (moov at the end) go straight to the file path, queueing once
+        head = await fetch_head(client, self.video) if STREAM_TRANSCODE else None
+        if head is not None:
+            result = await run_with_status(
+                progress, 'stream', stream_transcode, client, self.video, head, profile, progress.ffmpeg_callback,
+                priority=self.priority, timer=timer
+            )
+            video_data = result.data
+            timer.add('stream', result.encode_time)
+            timer.streamed = video_data is not None
+
+        timer.bytes_in(self.video.size)
+        if video_data is None:
+            with timer.stage('download'):
+                progress.set_stage('download')
+                await transfer.download(client, self.video, self.path_in, progress_callback=progress.download_callback)
+            self.content_hash = await asyncio.to_thread(result_cache.file_sha256, self.path_in)
+            if use_cache:
+                self.cached = await result_cache.lookup(self.owner, content_hash=self.content_hash)
+                if self.cached is not None:
+                    return
+
+            result = await run_with_status(
+                progress, 'ffmpeg', engine.transcode_file, self.path_in, self.path_out, profile,
+                progress.ffmpeg_callback, priority=self.priority, timer=timer
+            )
+            timer.add('ffmpeg', result.encode_time)
+
+            if not result.success or not os.path.exists(self.path_out):
+                raise Exception("FFmpeg processing failed.")
+
+        timer.path = result.path
+        progress.set_stage('upload')
+        with timer.stage('upload'):
+            if video_data is not None:
+                self.uploaded_file = await transfer.upload(
+                    client, video_data, file_name="note.mp4", progress_callback=progress.upload_callback
+                )
+            else:
+                self.uploaded_file = await transfer.upload(
+                    client, self.path_out, progress_callback=progress.upload_callback
+                )
+        timer.bytes_out(result.output_size)
+        self.result = result
+
+    async def send(self, peer):
+        if self.cached is not None:
+            updates = await result_cache.send_cached(self.client, self.cached, peer, self.message)
+            if updates is not None:
+                self.timer.path = 'cache'
+                return updates
+            # The cached note is gone for good; make a fresh one
+            self.cached = None
+            await self._encode(use_cache=False)
+
+        video_attribute = types.DocumentAttributeVideo(
+            duration=self.decision.duration,
+            w=self.result.note_size, h=self.result.note_size,
+            round_message=True
+        )
+
+        with self.timer.stage('send'):
+            updates = await self.client(functions.messages.SendMediaRequest(
+                peer=peer,
+                media=types.InputMediaUploadedDocument(
+                    file=self.uploaded_file, mime_type='video/mp4', attributes=[video_attribute]
+                ),
+                message=self.message.message or "",
+                entities=self.message.entities,
+                random_id=random.randint(0, 2**63 - 1)
+            ))
+        await result_cache.store(self.owner, self.video.id, updates, self.content_hash)
+        return updates
+
+    def cleanup(self):
+        for p in [self.path_in, self.path_out]:
+            if os.path.exists(p):
+                try: os.remove(p)
+                except: pass
+
+
+async def run_album(jobs, peer):
+    """
+    Prepares every job at once (the transcoder's workers bound how many
+    actually encode) and sends the notes in album order, each as soon as it
+    and all before it are ready. Returns (sent, busy, failed) counts.
+    """
+    tasks = [asyncio.create_task(job.prepare()) for job in jobs]
+    sent = busy = failed = 0
+    try:
+        for job, task in zip(jobs, tasks):
+            try:
+                await task
+                await job.send(peer)
+                job.timer.outcome = 'ok'
+                sent += 1
+            except QueueFullError:
+                job.timer.outcome = 'busy'
+                busy += 1
+            except Exception as e:
+                print(f"Album item {job.message.id} failed: {e}")
+                failed += 1
+            finally:
+                job.progress.complete()
+                job.cleanup()
+                await job.timer.save()
+    finally:
+        for job, task in zip(jobs, tasks):
+            task.cancel()
+            job.cleanup()
+    return sent, busy, failed
@@ -0,0 +1,223 @@
+import os
+import time
+import asyncio
+
+# Jobs done before this never get a status message at all
+PROGRESS_QUIET_SECONDS = float(os.getenv('PROGRESS_QUIET_SECONDS') or 3)
+# At most one edit per interval, and only when the percentage moved this much
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL') or 4)
+PROGRESS_MIN_STEP = 10
+
+# Share of the overall percentage each stage covers. 'stream' is the piped
+# path, where download and encode overlap and ffmpeg's position leads.
+STAGE_SPANS = {
+    'download': (0, 35),
+    'ffmpeg': (35, 80),
+    'stream': (0, 80),
+    'upload': (80, 100),
+}
+STAGE_LABELS = {
+    'download': "⬇️ **Downloading...**",
+    'ffmpeg': "⚙️ **Cropping...**",
+    'stream': "⚙️ **Cropping...**",
+    'upload': "⬆️ **Uploading...**",
+}
+
+
+class ItemProgress:
+    """Where one video of a job is: its stage, percentage and queue position."""
+
+    def __init__(self, reporter, duration=None):
+        self.reporter = reporter
+        self.duration = duration
+        self.stage = None
+        self.percent = 0
+        self.queue_position = 0
+        self.done = False
+
+    def set_stage(self, stage):
+        self.queue_position = 0
+        # A fallback can move back to an earlier stage
+        self.percent = STAGE_SPANS[stage][0]
+        self.update(stage, 0.0)
+
+    def update(self, stage, fraction):
+        start, end = STAGE_SPANS[stage]
+        fraction = min(max(fraction, 0.0), 1.0)
+        self.stage = stage
+        self.percent = max(self.percent, int(start + (end - start) * fraction))
+        self.reporter._schedule()
+
+    def queued(self, position):
+        self.queue_position = position
+        self.reporter._schedule()
+
+    def complete(self):
+        self.queue_position = 0
+        self.percent = 100
+        self.done = True
+        self.reporter._schedule()
+
+    def download_callback(self, current, total):
+        if total:
+            self.update('download', current / total)
+
+    def upload_callback(self, current, total):
+        if total:
+            self.update('upload', current / total)
+
+    def ffmpeg_callback(self, seconds):
+        """Called with ffmpeg's output position, possibly from a worker thread."""
+        if self.duration and self.stage in ('ffmpeg', 'stream'):
+            self.reporter._loop.call_soon_threadsafe(self.update, self.stage, seconds / self.duration)
+
+
+class ProgressReporter:
+    """
+    One status message per job, driven by Telethon's transfer callbacks and
+    ffmpeg's -progress output. Updates only record state; a single
+    background task turns them into edits, spaced by PROGRESS_MIN_INTERVAL
+    and skipped when nothing changed meaningfully. The message itself is
+    only sent once the job outlives PROGRESS_QUIET_SECONDS.
+
+    A job covering several videos (an album) gets one ItemProgress per
+    video via item(); the message then shows their average. The
+    single-video methods below all act on the first item.
+    """
+
+    def __init__(self, event, title, duration=None, count=1):
+        self.event = event
+        self.title = title
+        self.items = [ItemProgress(self, duration) for _ in range(count)]
+        self.message = None
+        self.started = time.monotonic()
+        self.shown = None  # (label, percent) last put on screen
+        self.last_edit = 0.0
+        self.closed = False
+        self._sending = False
+        self._task = None
+        self._loop = asyncio.get_running_loop()
+
+    def item(self, index, duration=None):
+        item = self.items[index]
+        if duration is not None:
+            item.duration = duration
+        return item
+
+    # --- state updates, cheap and synchronous ---
+
+    def set_stage(self, stage):
+        self.items[0].set_stage(stage)
+
+    def update(self, stage, fraction):
+        self.items[0].update(stage, fraction)
+
+    def queued(self, position):
+        self.items[0].queued(position)
+
+    def download_callback(self, current, total):
+        self.items[0].download_callback(current, total)
+
+    def upload_callback(self, current, total):
+        self.items[0].upload_callback(current, total)
+
+    def ffmpeg_callback(self, seconds):
+        self.items[0].ffmpeg_callback(seconds)
+
+    @property
+    def percent(self):
+        return sum(item.percent for item in self.items) // len(self.items)
+
+    # --- rendering ---
+
+    def _queue_position(self):
+        """Nearest queue position while every unfinished video is still waiting, else 0."""
+        pending = [item for item in self.items if not item.done]
+        if pending and all(item.queue_position for item in pending):
+            return min(item.queue_position for item in pending)
+        return 0
+
+    def _label(self):
+        position = self._queue_position()
+        if position:
+            return f"🕒 **In queue...** Position: {position}"
+        if len(self.items) > 1:
+            done = sum(item.done for item in self.items)
+            return f"🎞 **Converting {len(self.items)} videos...** ({done}/{len(self.items)} done)"
+        return STAGE_LABELS.get(self.items[0].stage, self.title)
+
+    def _text(self, label, percent):
+        if self._queue_position() or all(item.stage is None for item in self.items):
+            return label
+        filled = percent // 10
+        return f"{label} {percent}%\n`{'█' * filled}{'░' * (10 - filled)}`"
+
+    def _worth_showing(self, label, percent):
+        if self.shown is None:
+            return True
+        shown_label, shown_percent = self.shown
+        return label != shown_label or percent - shown_percent >= PROGRESS_MIN_STEP
+
+    def _schedule(self):
+        if self.closed or (self._task and not self._task.done()):
+            return
+        self._task = self._loop.create_task(self._flush())
+
+    async def _flush(self):
+        while not self.closed:
+            now = time.monotonic()
+            wait = max(
+                self.started + PROGRESS_QUIET_SECONDS - now,
+                self.last_edit + PROGRESS_MIN_INTERVAL - now
+            )
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            label, percent = self._label(), self.percent
+            if not self._worth_showing(label, percent):
+                return
+            self._sending = True
+            try:
+                text = self._text(label, percent)
+                if self.message is None:
+                    self.message = await self.event.respond(text)
+                else:
+                    await self.message.edit(text)
+            except Exception as e:
+                print(f"Progress update failed: {e}")
+            finally:
+                self._sending = False
+            self.shown = (label, percent)
+            self.last_edit = time.monotonic()
+
+    # --- end of job ---
+
+    async def _close(self):
+        self.closed = True
+        if self._task and not self._task.done():
+            # Let an in-flight send finish so we know whether a message exists
+            if not self._sending:
+                self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def finish(self):
+        await self._close()
+        if self.message is not None:
+            try:
+                await self.message.delete()
+            except Exception:
+                pass
+
+    async def fail(self, text):
+        await self._close()
+        try:
+            if self.message is not None:
+                await self.message.edit(text)
+            else:
+                await self.event.respond(text)
+        except Exception as e:
+            print(f"Progress update failed: {e}")
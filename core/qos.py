@@ -0,0 +1,140 @@
+import os
+from dataclasses import dataclass, replace
+from core.metrics import counter, gauge
+from core.scheduler import transcoder, tier_name, PRIORITY_PREMIUM, PRIORITY_FREE
+
+QOS_ENABLED = (os.getenv('QOS_ENABLED') or '1') == '1'
+# End-to-end job time each tier should stay under, in seconds
+LATENCY_TARGETS = {
+    'premium': float(os.getenv('QOS_PREMIUM_TARGET') or 30),
+    'free': float(os.getenv('QOS_FREE_TARGET') or 90),
+}
+# 1-minute load average per core above which the box counts as saturated
+QOS_CPU_HIGH = float(os.getenv('QOS_CPU_HIGH') or 0.9)
+
+PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow']
+
+
+@dataclass(frozen=True)
+class Step:
+    """How far one QoS level moves a profile: faster preset, higher CRF, lower frame rate."""
+    preset_shift: int
+    crf_delta: int
+    fps: int = None
+
+
+# Level 0 is the profile as configured; each level trades more quality for speed
+LADDER = [
+    Step(0, 0),
+    Step(1, 2),
+    Step(2, 3, fps=30),
+    Step(3, 5, fps=24),
+]
+# Pressure (predicted time / target) at which each level after 0 kicks in
+THRESHOLDS = [0.75, 1.0, 1.5]
+
+decisions = counter('qos_decisions_total', 'Encoder settings picked by the QoS controller, by tier and level')
+pressure_gauge = gauge('qos_pressure', 'Last predicted job time over the latency target, by tier')
+
+
+@dataclass
+class Decision:
+    tier: str
+    level: int
+    profile: object
+    predicted: float
+    pressure: float
+    load: float
+
+
+def cpu_load():
+    """1-minute load average per core, or 0.0 where the OS doesn't report one."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def level_for(pressure):
+    return sum(1 for threshold in THRESHOLDS if pressure >= threshold)
+
+
+def apply(profile, level, threads):
+    step = LADDER[level]
+    preset = profile.preset
+    if step.preset_shift and preset in PRESETS:
+        preset = PRESETS[max(0, PRESETS.index(preset) - step.preset_shift)]
+    fps = min(filter(None, (profile.fps, step.fps)), default=None)
+    return replace(profile, preset=preset, crf=min(51, profile.crf + step.crf_delta), fps=fps, threads=threads)
+
+
+class QoSController:
+    """
+    Picks encoder settings per job from the transcoder's load: the job's
+    predicted time (queue ahead of it plus one run, from the scheduler's
+    running averages) over its tier's latency target gives a pressure, and
+    the pressure a level on LADDER.
+
+    Free jobs degrade first: they also count as over target whenever the
+    CPU is saturated, and premium jobs always stay at least one level
+    above the free tier. Idle boxes give a lone job the cores the other
+    workers aren't using.
+    """
+
+    def __init__(self, scheduler=transcoder, targets=LATENCY_TARGETS, enabled=QOS_ENABLED):
+        self.scheduler = scheduler
+        self.targets = targets
+        self.enabled = enabled
+
+    def predict(self, priority):
+        scheduler = self.scheduler
+        run = scheduler.avg_run or 0.0
+        ahead = scheduler.ahead_of(priority)
+        idle = scheduler.workers - scheduler.in_flight
+        waits = max(0, ahead + 1 - idle)
+        predicted = waits * run / scheduler.workers + run
+        # A backlog the averages haven't caught up with yet still shows in recent waits
+        if ahead:
+            predicted = max(predicted, (scheduler.avg_wait.get(tier_name(priority)) or 0.0) + run)
+        return predicted
+
+    def pressure(self, priority, load):
+        pressure = self.predict(priority) / self.targets[tier_name(priority)]
+        if priority != PRIORITY_PREMIUM and load >= QOS_CPU_HIGH:
+            pressure = max(pressure, THRESHOLDS[1])
+        return pressure
+
+    def threads(self, profile):
+        scheduler = self.scheduler
+        if scheduler.depth:
+            return profile.threads
+        # Nothing queued: split the cores between what's actually running
+        return max(profile.threads, (os.cpu_count() or 1) // (scheduler.in_flight + 1))
+
+    def tune(self, profile, priority):
+        """The profile to encode this job with, and why; logged once per job."""
+        tier = tier_name(priority)
+        if not self.enabled:
+            return Decision(tier, 0, profile, 0.0, 0.0, 0.0)
+
+        load = cpu_load()
+        pressure = self.pressure(priority, load)
+        level = level_for(pressure)
+        if priority == PRIORITY_PREMIUM:
+            free_level = level_for(self.pressure(PRIORITY_FREE, load))
+            level = min(level, max(0, free_level - 1))
+
+        tuned = apply(profile, level, self.threads(profile))
+        decision = Decision(tier, level, tuned, self.predict(priority), pressure, load)
+
+        decisions.inc(tier=tier, level=str(level))
+        pressure_gauge.set(round(pressure, 3), tier=tier)
+        print(
+            f"QoS {tier}: level {level} -> {tuned.preset}/crf {tuned.crf}/{tuned.fps or 'src'} fps/"
+            f"{tuned.threads} threads; predicted {decision.predicted:.1f}s of {self.targets[tier]:.0f}s, "
+            f"queue {self.scheduler.depth}, running {self.scheduler.in_flight}, cpu {load:.0%}"
+        )
+        return decision
+
+
+controller = QoSController()
@@ -0,0 +1,121 @@
+import os
+import random
+import hashlib
+from datetime import timedelta
+from telethon import functions, types
+from telethon.errors import (
+    FileReferenceExpiredError, FileReferenceInvalidError, FileReferenceEmptyError,
+    MediaEmptyError, MediaInvalidError, DocumentInvalidError, FileIdInvalidError
+)
+from tortoise import timezone
+from db.database import TranscodeCache
+
+TRANSCODE_CACHE_MAX = int(os.getenv('TRANSCODE_CACHE_MAX') or 5000)
+TRANSCODE_CACHE_TTL_DAYS = int(os.getenv('TRANSCODE_CACHE_TTL_DAYS') or 30)
+
+STALE_REFERENCE_ERRORS = (FileReferenceExpiredError, FileReferenceInvalidError, FileReferenceEmptyError)
+DEAD_MEDIA_ERRORS = (MediaEmptyError, MediaInvalidError, DocumentInvalidError, FileIdInvalidError)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_from_updates(updates):
+    """Finds the round note we just sent in a SendMediaRequest result."""
+    for update in getattr(updates, 'updates', []):
+        message = getattr(update, 'message', None)
+        if isinstance(message, types.Message) and isinstance(message.media, types.MessageMediaDocument):
+            return message, message.media.document
+    return None, None
+
+
+async def lookup(owner, source_id=None, content_hash=None):
+    if source_id is not None:
+        entry = await TranscodeCache.get_or_none(owner=owner, source_id=source_id)
+        if entry:
+            return entry
+    if content_hash:
+        return await TranscodeCache.filter(owner=owner, content_hash=content_hash).first()
+    return None
+
+
+async def _send(client, entry, peer, message):
+    return await client(functions.messages.SendMediaRequest(
+        peer=peer,
+        media=types.InputMediaDocument(id=types.InputDocument(
+            id=entry.document_id,
+            access_hash=entry.access_hash,
+            file_reference=entry.file_reference
+        )),
+        message=message.message or "",
+        entities=message.entities,
+        random_id=random.randint(0, 2**63 - 1)
+    ))
+
+
+async def send_cached(client, entry, peer, message):
+    """
+    Re-sends a cached note with the user's own caption and entities.
+    Returns the updates, or None when the entry is missing or unusable.
+    """
+    if entry is None:
+        return None
+
+    try:
+        updates = await _send(client, entry, peer, message)
+    except STALE_REFERENCE_ERRORS:
+        # Refetch the message we originally sent to get a fresh file_reference
+        original = await client.get_messages(None, ids=entry.message_id)
+        document = getattr(original, 'document', None)
+        if not document or document.id != entry.document_id:
+            await entry.delete()
+            return None
+        entry.file_reference = document.file_reference
+        await entry.save(update_fields=['file_reference'])
+        try:
+            updates = await _send(client, entry, peer, message)
+        except STALE_REFERENCE_ERRORS + DEAD_MEDIA_ERRORS:
+            await entry.delete()
+            return None
+    except DEAD_MEDIA_ERRORS:
+        await entry.delete()
+        return None
+
+    await TranscodeCache.filter(id=entry.id).update(last_used_at=timezone.now())
+    return updates
+
+
+async def store(owner, source_id, updates, content_hash=None):
+    sent_message, document = document_from_updates(updates)
+    if document is None:
+        return
+
+    await TranscodeCache.update_or_create(
+        owner=owner,
+        source_id=source_id,
+        defaults={
+            'content_hash': content_hash,
+            'document_id': document.id,
+            'access_hash': document.access_hash,
+            'file_reference': document.file_reference,
+            'message_id': sent_message.id,
+            'last_used_at': timezone.now()
+        }
+    )
+    await evict()
+
+
+async def evict():
+    """Drops entries past the TTL, then the least recently used ones above the cap."""
+    now = timezone.now()
+    await TranscodeCache.filter(last_used_at__lt=now - timedelta(days=TRANSCODE_CACHE_TTL_DAYS)).delete()
+
+    overflow = await TranscodeCache.all().count() - TRANSCODE_CACHE_MAX
+    if overflow > 0:
+        stale_ids = await TranscodeCache.all().order_by('last_used_at').limit(overflow).values_list('id', flat=True)
+        await TranscodeCache.filter(id__in=list(stale_ids)).delete()
@@ -0,0 +1,38 @@
+import time
+from core.metrics import counter, histogram
+from core.users import register_user
+
+route_updates = counter('bot_updates_total', 'Updates dispatched, by route')
+route_latency = histogram('bot_handler_seconds', 'Handler run time, by route')
+
+
+class Router:
+    """
+    One dispatch table per client. Each update is classified once by the
+    caller and handed to exactly one handler; the user row is resolved
+    here, at most once, and only for routes that need it.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def route(self, name, needs_user=False):
+        def decorator(func):
+            self.handlers[name] = (func, needs_user)
+            return func
+        return decorator
+
+    async def dispatch(self, name, event):
+        if name not in self.handlers:
+            return
+        handler, needs_user = self.handlers[name]
+
+        started = time.monotonic()
+        try:
+            if needs_user:
+                user = await register_user(event)
+                return await handler(event, user)
+            return await handler(event)
+        finally:
+            route_updates.inc(route=name)
+            route_latency.observe(time.monotonic() - started, route=name)
@@ -0,0 +1,189 @@
+import os
+import time
+import asyncio
+import itertools
+from core.metrics import gauge, histogram
+
+# Worker count defaults to half the cores: libx264 already spreads one encode
+# over several threads, so more parallel jobs only fight for the same CPUs.
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS') or 0) or max(1, (os.cpu_count() or 2) // 2)
+TRANSCODE_QUEUE_LIMIT = int(os.getenv('TRANSCODE_QUEUE_LIMIT') or 50)
+
+PRIORITY_PREMIUM = 0
+PRIORITY_FREE = 1
+
+# Weight of the newest sample in the running wait / run time averages
+EWMA_WEIGHT = 0.2
+
+queue_depth = gauge('transcode_queue_depth', 'Jobs waiting for a transcode worker')
+jobs_in_flight = gauge('transcode_jobs_in_flight', 'Jobs currently running on a transcode worker')
+queue_wait = histogram('transcode_queue_wait_seconds', 'Time a job waited for a worker, by tier')
+
+
+class QueueFullError(Exception):
+    """Raised when the transcoding queue can't take any more jobs."""
+
+
+def tier_name(priority):
+    return 'premium' if priority == PRIORITY_PREMIUM else 'free'
+
+
+def ewma(average, sample):
+    return sample if average is None else average + EWMA_WEIGHT * (sample - average)
+
+
+class Job:
+    def __init__(self, scheduler, key, func, args):
+        self.scheduler = scheduler
+        self.key = key
+        self.func = func
+        self.args = args
+        self.started = asyncio.Event()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def position(self):
+        """1-based place in line, 0 once a worker has picked the job up."""
+        return self.scheduler.position(self)
+
+    async def result(self):
+        return await self.future
+
+    def cancel(self):
+        """Abandons the job: a running one is stopped, a queued one gives its slot back."""
+        self.future.cancel()
+        self.scheduler._waiting.pop(self.key, None)
+
+
+class TranscodeScheduler:
+    """
+    Shared priority queue in front of ffmpeg.
+    A fixed set of workers pulls jobs, premium before free, FIFO within a tier.
+    """
+
+    def __init__(self, workers=TRANSCODE_WORKERS, max_queue=TRANSCODE_QUEUE_LIMIT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.avg_run = None   # seconds a job holds a worker
+        self.avg_wait = {}    # tier -> seconds a job waited for one
+        self._queue = None
+        self._waiting = {}
+        self._tasks = []
+        self._seq = itertools.count()
+
+    @property
+    def depth(self):
+        return len(self._waiting)
+
+    def is_full(self):
+        return self.max_queue > 0 and self.depth >= self.max_queue
+
+    def ahead_of(self, priority):
+        """Waiting jobs a new job with this priority would queue behind."""
+        return sum(1 for key in self._waiting if key[0] <= priority)
+
+    def position(self, job):
+        if job.key not in self._waiting:
+            return 0
+        ahead = sum(1 for key in self._waiting if key < job.key)
+        idle = self.workers - self.in_flight
+        return max(0, ahead + 1 - idle)
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"✅ Transcoder started with {self.workers} workers")
+
+    def submit(self, func, *args, priority=PRIORITY_FREE):
+        """
+        Queues func(*args). Coroutine functions are awaited on the worker,
+        plain functions run in a thread. Cancelling the job's result cancels
+        a running coroutine too. Raises QueueFullError on backpressure.
+        """
+        if self.is_full():
+            raise QueueFullError(f"Transcode queue is full ({self.depth} jobs waiting)")
+
+        self._ensure_started()
+        key = (priority, next(self._seq))
+        job = Job(self, key, func, args)
+        self._waiting[key] = job
+        self._queue.put_nowait((key, job))
+        return job
+
+    async def run(self, func, *args, priority=PRIORITY_FREE):
+        job = self.submit(func, *args, priority=priority)
+        return await job.result()
+
+    async def _worker(self):
+        while True:
+            key, job = await self._queue.get()
+            self._waiting.pop(key, None)
+
+            if job.future.cancelled():
+                self._queue.task_done()
+                continue
+
+            self.in_flight += 1
+            job.started_at = time.monotonic()
+            tier = tier_name(key[0])
+            waited = job.started_at - job.submitted_at
+            queue_wait.observe(waited, tier=tier)
+            self.avg_wait[tier] = ewma(self.avg_wait.get(tier), waited)
+            job.started.set()
+            if asyncio.iscoroutinefunction(job.func):
+                work = asyncio.ensure_future(job.func(*job.args))
+            else:
+                work = asyncio.ensure_future(asyncio.to_thread(job.func, *job.args))
+            # If the submitter gives up, stop the work (killing its ffmpeg) rather than finish it
+            job.future.add_done_callback(lambda future, work=work: work.cancel() if future.cancelled() else None)
+            try:
+                result = await work
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                # Only an abandoned job is absorbed; stop() cancelling the worker goes through
+                if asyncio.current_task().cancelling():
+                    raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.in_flight -= 1
+                self.avg_run = ewma(self.avg_run, time.monotonic() - job.started_at)
+                self._queue.task_done()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+transcoder = TranscodeScheduler()
+queue_depth.track(lambda: transcoder.depth)
+jobs_in_flight.track(lambda: transcoder.in_flight)
+
+
+async def run_with_status(progress, stage, func, *args, priority=PRIORITY_FREE, timer=None):
+    """
+    Submits a job, reports its queue position and then `stage` on the
+    progress reporter, and waits for the result.
+    """
+    job = transcoder.submit(func, *args, priority=priority)
+    try:
+        if job.position:
+            progress.queued(job.position)
+        await job.started.wait()
+    except asyncio.CancelledError:
+        # Abandoned while queued: the worker must skip it, not run ffmpeg for nobody
+        job.cancel()
+        raise
+    if timer is not None:
+        timer.add('queue', job.started_at - job.submitted_at)
+    progress.set_stage(stage)
+    return await job.result()
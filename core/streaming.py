@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+from core.engine import EncodeResult, build_command, choose_path, output_side, parse_progress, probe_bytes, report
+from core.governor import FFmpegRun
+
+STREAM_TRANSCODE = (os.getenv('STREAM_TRANSCODE') or '1') == '1'
+STREAM_CHUNK_SIZE = 512 * 1024
+
+# Containers ffmpeg can demux front-to-back from a pipe
+STREAMABLE_MIME_TYPES = {'video/webm', 'video/x-matroska', 'video/mp2t', 'video/mpeg'}
+# MP4 family: only streamable when the moov atom comes before mdat
+ISO_BMFF_MIME_TYPES = {'video/mp4', 'video/quicktime', 'video/3gpp'}
+
+
+def moov_before_mdat(head):
+    """Walks the top-level MP4 boxes in the first downloaded chunk."""
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box = head[offset + 4:offset + 8]
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                return False
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+def is_streamable(mime_type, head):
+    mime_type = (mime_type or '').lower()
+    if mime_type in STREAMABLE_MIME_TYPES:
+        return True
+    if mime_type in ISO_BMFF_MIME_TYPES:
+        return moov_before_mdat(head)
+    return False
+
+
+async def fetch_head(client, document):
+    """
+    The first chunk, if the container can be piped; None otherwise. Called
+    before queueing, so only streamable inputs ever take a transcode worker.
+    """
+    chunks = client.iter_download(document, request_size=STREAM_CHUNK_SIZE, limit=1)
+    try:
+        head = await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+    finally:
+        await chunks.close()
+    return head if is_streamable(document.mime_type, head) else None
+
+
+async def stream_transcode(client, document, head, profile, on_progress=None):
+    """
+    Feeds the head from fetch_head() and the rest of the iter_download
+    chunks straight into ffmpeg's stdin and collects the encoded note in
+    memory, so download and encode overlap with no disk I/O.
+    An unsuccessful result means the caller should fall back to the
+    file-based path (ffmpeg failure); a timeout raises instead, since the
+    file path would only hang the same way.
+    """
+    chunks = client.iter_download(document, offset=len(head), request_size=STREAM_CHUNK_SIZE)
+    started = time.monotonic()
+    info = await probe_bytes(head)
+    path = choose_path(info, document.size)
+    command = build_command(profile, 'pipe:0', 'pipe:1', fragmented=True, info=info, path=path, progress='pipe:2')
+
+    def watch(line):
+        # stdout carries the video, so -progress goes to stderr
+        position = parse_progress(line)
+        if position is not None and on_progress:
+            on_progress(position)
+
+    try:
+        async with FFmpegRun(
+            command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, on_stderr=watch
+        ) as run:
+            process = run.process
+
+            async def feed():
+                try:
+                    process.stdin.write(head)
+                    await process.stdin.drain()
+                    if len(head) < document.size:
+                        async for chunk in chunks:
+                            process.stdin.write(chunk)
+                            await process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    # ffmpeg gave up early, its exit code tells the rest
+                    pass
+                finally:
+                    process.stdin.close()
+
+            feeder = asyncio.create_task(feed())
+            try:
+                output = await process.stdout.read()
+                returncode = await run.wait()
+                await feeder
+            finally:
+                feeder.cancel()
+    finally:
+        await chunks.close()
+
+    if returncode != 0 or not output:
+        print(f"FFmpeg Stream Error: exit code {returncode}, falling back to file\n{run.tail()}")
+        return EncodeResult(False, profile.name, path, encode_time=time.monotonic() - started)
+
+    result = EncodeResult(
+        True, profile.name, path,
+        encode_time=time.monotonic() - started,
+        output_size=len(output),
+        note_size=output_side(info, path),
+        data=output
+    )
+    report(result, f"document {document.id}")
+    return result
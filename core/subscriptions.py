@@ -0,0 +1,133 @@
+import os
+import asyncio
+from datetime import date, timedelta
+from telethon import functions
+from telethon.extensions import markdown
+from telethon.errors import (
+    FloodWaitError, UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError
+)
+from db.database import User
+from core import users
+from core.broadcast import FloodLane, bucket, flood_wait_seconds, random_id
+from core.metrics import counter
+
+EXPIRY_INTERVAL = int(os.getenv('EXPIRY_INTERVAL') or 3600)
+# Days before expiry to send the renewal reminder; 0 turns reminders off
+EXPIRY_NOTICE_DAYS = int(os.getenv('EXPIRY_NOTICE_DAYS') or 0)
+NOTICE_BATCH = 200
+
+expired_total = counter('premium_expired_total', 'Subscriptions switched off by the expiry sweep')
+notices_total = counter('premium_expiry_notices_total', 'Expiring-soon reminders, by result')
+
+
+async def expire(today=None):
+    """Clears is_premium for every lapsed subscription in one statement."""
+    today = today or date.today()
+    count = await User.filter(is_premium=True, premium_expiry_date__lt=today).update(is_premium=False)
+    if count:
+        expired_total.inc(count)
+        # Cached rows are judged by their expiry date, so only the flag is behind
+        for user in users.user_cache.values():
+            if user.is_premium and not users.has_active_subscription(user):
+                user.is_premium = False
+        print(f"⌛ Premium expired for {count} users")
+    return count
+
+
+async def send_notices(client, days=EXPIRY_NOTICE_DAYS, today=None):
+    """
+    Reminds users whose subscription ends within the next `days` days.
+    premium_notice_for remembers which expiry date was announced, so each
+    subscription period gets one reminder however often this runs.
+    """
+    today = today or date.today()
+    horizon = today + timedelta(days=days)
+    # FloodWaits go to the shared bucket rather than being slept off in Telethon
+    lane = FloodLane(client)
+    after_id = 0
+    sent = 0
+
+    while True:
+        rows = await User.filter(
+            id__gt=after_id,
+            is_premium=True,
+            premium_expiry_date__gte=today,
+            premium_expiry_date__lte=horizon
+        ).order_by('id').limit(NOTICE_BATCH).values_list('id', 'access_hash', 'premium_expiry_date', 'premium_notice_for')
+        if not rows:
+            break
+        after_id = rows[-1][0]
+
+        notified = {}
+        for user_id, access_hash, expiry, notice_for in rows:
+            if notice_for == expiry:
+                continue
+            text, entities = markdown.parse(
+                "⏳ **Your Premium is ending soon**\n\n"
+                f"📅 Expires on: **{expiry.strftime('%Y-%m-%d')}**\n\n"
+                "Renew from the 💎 Premium menu to keep unlimited conversions."
+            )
+            await bucket.acquire()
+            try:
+                await lane(functions.messages.SendMessageRequest(
+                    peer=users.input_peer(user_id, access_hash),
+                    message=text,
+                    entities=entities,
+                    random_id=random_id()
+                ))
+                notices_total.inc(result='sent')
+                sent += 1
+            except FloodWaitError as e:
+                flood_wait_seconds.inc(e.seconds, source='expiry_notice')
+                bucket.penalize(e.seconds)
+                notices_total.inc(result='deferred')
+                # Not marked; the next run picks it up
+                continue
+            except (UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError):
+                notices_total.inc(result='blocked')
+            except Exception as e:
+                print(f"Expiry notice to {user_id} failed: {e}")
+                notices_total.inc(result='failed')
+                # Not marked either, so a passing error doesn't cost the reminder
+                continue
+            notified.setdefault(expiry, []).append(user_id)
+
+        for expiry, ids in notified.items():
+            await User.filter(id__in=ids).update(premium_notice_for=expiry)
+
+    if sent:
+        print(f"⏳ Sent {sent} expiring-soon notices")
+    return sent
+
+
+class ExpiryScheduler:
+    """Runs the expiry sweep (and optional reminders) in the background."""
+
+    def __init__(self, interval=EXPIRY_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def run_once(self, client=None):
+        await expire()
+        if client is not None and EXPIRY_NOTICE_DAYS > 0:
+            await send_notices(client)
+
+    async def _run(self, client):
+        while True:
+            try:
+                await self.run_once(client)
+            except Exception as e:
+                print(f"Expiry sweep error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, client=None):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(client))
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+expiry = ExpiryScheduler()
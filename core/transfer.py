@@ -0,0 +1,290 @@
+import os
+import hashlib
+import time
+import asyncio
+import random
+from telethon import functions, types, utils
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from core.metrics import counter, gauge
+
+# Connections per transfer; 1 turns the parallel path off
+TRANSFER_CONNECTIONS = int(os.getenv('TRANSFER_CONNECTIONS') or 4)
+# Extra connections open at once across all transfers and DCs
+TRANSFER_MAX_CONNECTIONS = int(os.getenv('TRANSFER_MAX_CONNECTIONS') or 8)
+# Smaller files aren't worth the extra connection handshakes
+TRANSFER_MIN_SIZE = int(os.getenv('TRANSFER_MIN_MB') or 4) * 1024 * 1024
+# Idle pooled connections are closed after this long
+TRANSFER_IDLE_SECONDS = 60
+PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+transfers = counter('transfers_total', 'File transfers, by direction and mode (parallel / sequential / capped / fallback)')
+open_connections = gauge('transfer_connections', 'Extra MTProto connections open for parallel transfers')
+
+_connections = 0
+_pools = {}
+open_connections.track(lambda: _connections)
+
+
+class SenderPool:
+    """
+    Long-lived extra MTProto connections to one DC, shared by every
+    parallel transfer. The home DC reuses the session's auth key; other
+    DCs import an exported authorization once and keep the resulting key
+    for as long as the process lives. Connections across all pools are
+    capped at TRANSFER_MAX_CONNECTIONS; idle ones close after
+    TRANSFER_IDLE_SECONDS.
+    """
+
+    def __init__(self, client, dc_id):
+        self.client = client
+        self.dc_id = dc_id
+        self.auth_key = client.session.auth_key if dc_id == client.session.dc_id else None
+        self.idle = []  # (sender, idle since)
+        self._auth_lock = asyncio.Lock()
+        self._sweeper = None
+
+    async def _create(self):
+        client = self.client
+        dc = await client._get_dc(self.dc_id)
+        sender = MTProtoSender(self.auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=client._log, proxy=client._proxy, local_addr=client._local_addr
+        ))
+        if self.auth_key is None:
+            try:
+                auth = await client(functions.auth.ExportAuthorizationRequest(self.dc_id))
+                client._init_request.query = functions.auth.ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                await sender.send(functions.InvokeWithLayerRequest(LAYER, client._init_request))
+            except BaseException:
+                await sender.disconnect()
+                raise
+            self.auth_key = sender.auth_key
+        return sender
+
+    async def _open(self, count):
+        """Opens up to count new connections within the global cap."""
+        global _connections
+        count = min(count, TRANSFER_MAX_CONNECTIONS - _connections)
+        if count <= 0:
+            return []
+        _connections += count  # Reserved up front, so concurrent transfers can't overshoot the cap
+        senders = []
+        try:
+            if self.auth_key is None:
+                # One export per DC: the first connection imports it, the rest reuse its key
+                async with self._auth_lock:
+                    if self.auth_key is None:
+                        senders.append(await self._create())
+            results = await asyncio.gather(
+                *(self._create() for _ in range(count - len(senders))), return_exceptions=True
+            )
+        except BaseException:
+            _connections -= count - len(senders)
+            for sender in senders:
+                await self._close(sender)
+            raise
+        for result in results:
+            if isinstance(result, BaseException):
+                _connections -= 1
+                print(f"Transfer connection to DC {self.dc_id} failed: {result}")
+            else:
+                senders.append(result)
+        return senders
+
+    async def acquire(self, count):
+        """Up to count connected senders, idle ones first; may be fewer, or none at the cap."""
+        senders = []
+        while self.idle and len(senders) < count:
+            sender, _ = self.idle.pop()
+            if sender.is_connected():
+                senders.append(sender)
+            else:
+                await self._close(sender)
+        if len(senders) < count:
+            senders += await self._open(count - len(senders))
+        return senders
+
+    def release(self, senders, healthy=True):
+        """Returns senders for reuse; after a failed transfer they are closed instead."""
+        now = time.monotonic()
+        for sender in senders:
+            if healthy:
+                self.idle.append((sender, now))
+            else:
+                asyncio.create_task(self._close(sender))
+        if self.idle and (self._sweeper is None or self._sweeper.done()):
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def _close(self, sender):
+        global _connections
+        _connections -= 1
+        try:
+            await sender.disconnect()
+        except Exception:
+            pass
+
+    async def _sweep(self):
+        while self.idle:
+            await asyncio.sleep(TRANSFER_IDLE_SECONDS / 2)
+            cutoff = time.monotonic() - TRANSFER_IDLE_SECONDS
+            expired = [sender for sender, since in self.idle if since < cutoff]
+            self.idle = [(sender, since) for sender, since in self.idle if since >= cutoff]
+            for sender in expired:
+                await self._close(sender)
+
+
+def pool_for(client, dc_id):
+    key = (id(client), dc_id)
+    if key not in _pools:
+        _pools[key] = SenderPool(client, dc_id)
+    return _pools[key]
+
+
+async def run_parts(senders, part_count, handle_part):
+    """Spreads parts 0..part_count-1 over the senders; handle_part(sender, index)."""
+    async def lane(offset, sender):
+        for index in range(offset, part_count, len(senders)):
+            await handle_part(sender, index)
+
+    lanes = [asyncio.create_task(lane(i, sender)) for i, sender in enumerate(senders)]
+    try:
+        await asyncio.gather(*lanes)
+    finally:
+        # A failed part stops the others before the caller closes the file or
+        # the senders; their errors are retrieved here, not logged as lost
+        for task in lanes:
+            task.cancel()
+        await asyncio.gather(*lanes, return_exceptions=True)
+
+
+async def run_pooled(client, dc_id, count, part_count, handle_part):
+    """
+    Runs the parts over pooled connections to dc_id. False means the
+    connection cap left nothing for this transfer and nothing was done.
+    """
+    pool = pool_for(client, dc_id)
+    senders = await pool.acquire(count)
+    if not senders:
+        return False
+    healthy = False
+    try:
+        await run_parts(senders, part_count, handle_part)
+        healthy = True
+    finally:
+        pool.release(senders, healthy)
+    return True
+
+
+def connections_for(size):
+    if TRANSFER_CONNECTIONS <= 1 or not size or size < TRANSFER_MIN_SIZE:
+        return 1
+    return max(1, min(TRANSFER_CONNECTIONS, -(-size // PART_SIZE)))
+
+
+async def _parallel_download(client, document, path, connections, progress_callback):
+    dc_id, location = utils.get_input_location(document)
+    size = document.size
+    part_count = -(-size // PART_SIZE)
+    done = 0
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+        async def fetch(sender, index):
+            nonlocal done
+            result = await client._call(sender, functions.upload.GetFileRequest(
+                location, offset=index * PART_SIZE, limit=PART_SIZE, precise=False
+            ))
+            f.seek(index * PART_SIZE)
+            f.write(result.bytes)
+            done += len(result.bytes)
+            if progress_callback:
+                progress_callback(done, size)
+
+        if not await run_pooled(client, dc_id or client.session.dc_id, connections, part_count, fetch):
+            return False
+
+    if os.path.getsize(path) != size or done != size:
+        raise IOError(f"Downloaded {done} of {size} bytes")
+    return True
+
+
+async def download(client, document, path, progress_callback=None):
+    """Downloads a Document to path over several connections, or sequentially for small files."""
+    connections = connections_for(document.size)
+    if connections > 1:
+        try:
+            if await _parallel_download(client, document, path, connections, progress_callback):
+                transfers.inc(direction='download', mode='parallel')
+                return path
+            transfers.inc(direction='download', mode='capped')
+        except Exception as e:
+            print(f"Parallel download failed, retrying sequentially: {e}")
+            transfers.inc(direction='download', mode='fallback')
+    else:
+        transfers.inc(direction='download', mode='sequential')
+    return await client.download_media(document, file=path, progress_callback=progress_callback)
+
+
+def _read_part(source, index):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[index * PART_SIZE:(index + 1) * PART_SIZE])
+    with open(source, 'rb') as f:
+        f.seek(index * PART_SIZE)
+        return f.read(PART_SIZE)
+
+
+async def _parallel_upload(client, source, size, file_name, connections, progress_callback):
+    part_count = -(-size // PART_SIZE)
+    file_id = random.randint(-2**63, 2**63 - 1)
+    is_big = size > BIG_FILE_SIZE
+    done = 0
+
+    async def send(sender, index):
+        nonlocal done
+        part = _read_part(source, index)
+        if is_big:
+            request = functions.upload.SaveBigFilePartRequest(file_id, index, part_count, part)
+        else:
+            request = functions.upload.SaveFilePartRequest(file_id, index, part)
+        if not await client._call(sender, request):
+            raise IOError(f"Telegram refused part {index}")
+        done += len(part)
+        if progress_callback:
+            progress_callback(done, size)
+
+    if not await run_pooled(client, client.session.dc_id, connections, part_count, send):
+        return None
+
+    if is_big:
+        return types.InputFileBig(file_id, part_count, file_name)
+    md5 = hashlib.md5()
+    for index in range(part_count):
+        md5.update(_read_part(source, index))
+    return types.InputFile(file_id, part_count, file_name, md5.hexdigest())
+
+
+async def upload(client, source, file_name=None, progress_callback=None):
+    """
+    Uploads bytes or a file path over several connections and returns the
+    InputFile, like client.upload_file (which is the fallback).
+    """
+    size = len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+    file_name = file_name or (os.path.basename(source) if isinstance(source, str) else 'file')
+    connections = connections_for(size)
+    if connections > 1:
+        try:
+            uploaded = await _parallel_upload(client, source, size, file_name, connections, progress_callback)
+            if uploaded is not None:
+                transfers.inc(direction='upload', mode='parallel')
+                return uploaded
+            transfers.inc(direction='upload', mode='capped')
+        except Exception as e:
+            print(f"Parallel upload failed, retrying sequentially: {e}")
+            transfers.inc(direction='upload', mode='fallback')
+    else:
+        transfers.inc(direction='upload', mode='sequential')
+    return await client.upload_file(source, file_name=file_name, progress_callback=progress_callback)
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from collections import OrderedDict
+from core.metrics import counter, gauge
+
+# SQLite file for stores created with persist=True; unset keeps them in memory
+STATE_DB_PATH = os.getenv('STATE_DB_PATH') or None
+SWEEP_INTERVAL = 60
+
+store_entries = gauge('ttl_store_entries', 'Live entries per TTL store')
+store_evictions = counter('ttl_store_evictions_total', 'Entries dropped from TTL stores, by store and reason')
+
+
+class TTLStore:
+    """
+    Dict-like store whose entries expire after `ttl` seconds and whose size
+    is capped at `max_size` (oldest write goes first). Expired entries are
+    dropped on access and by a background sweep.
+
+    With sliding=True, reading an entry extends its lifetime. With
+    persist=True and STATE_DB_PATH set, entries are written through to
+    SQLite and reloaded on start; values must then be JSON-serialisable.
+    """
+
+    def __init__(self, name, ttl, max_size=10000, sliding=False, persist=False, path=STATE_DB_PATH):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sliding = sliding
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._task = None
+        self._db = None
+
+        if persist and path:
+            self._open(path)
+        store_entries.track(lambda: len(self._entries), store=name)
+
+    def _open(self, path):
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS ttl_store '
+            '(store TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, '
+            'PRIMARY KEY (store, key))'
+        )
+        now = time.time()
+        self._db.execute('DELETE FROM ttl_store WHERE expires_at < ?', (now,))
+        rows = self._db.execute(
+            'SELECT key, value, expires_at FROM ttl_store WHERE store = ? ORDER BY expires_at', (self.name,)
+        ).fetchall()
+        for key, value, expires_at in rows[-self.max_size:]:
+            self._entries[json.loads(key)] = (json.loads(value), expires_at)
+
+    def _write(self, key, value, expires_at):
+        if self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO ttl_store (store, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (self.name, json.dumps(key), json.dumps(value), expires_at)
+            )
+
+    def _delete(self, keys):
+        if self._db and keys:
+            self._db.executemany(
+                'DELETE FROM ttl_store WHERE store = ? AND key = ?',
+                [(self.name, json.dumps(key)) for key in keys]
+            )
+
+    def _evict(self, key, reason):
+        del self._entries[key]
+        self._delete([key])
+        store_evictions.inc(store=self.name, reason=reason)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        now = time.time()
+        if expires_at < now:
+            self._evict(key, 'expired')
+            return default
+        if self.sliding:
+            self._entries[key] = (value, now + self.ttl)
+            self._entries.move_to_end(key)
+            self._write(key, value, now + self.ttl)
+        return value
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        self._write(key, value, expires_at)
+        while len(self._entries) > self.max_size:
+            self._evict(next(iter(self._entries)), 'capacity')
+        self._ensure_started()
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if key in self._entries:
+            del self._entries[key]
+            self._delete([key])
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.pop(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sweep(self):
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at < now]
+        for key in expired:
+            del self._entries[key]
+        self._delete(expired)
+        if expired:
+            store_evictions.inc(len(expired), store=self.name, reason='expired')
+        return len(expired)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"TTL store {self.name} sweep error: {e}")
+
+    def _ensure_started(self):
+        if self._task is None:
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                pass
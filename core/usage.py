@@ -0,0 +1,109 @@
+import os
+import asyncio
+from collections import defaultdict
+from datetime import date
+from tortoise.expressions import Case, F, Q, When
+from db.database import User
+
+USAGE_FLUSH_INTERVAL = int(os.getenv('USAGE_FLUSH_INTERVAL') or 10)
+
+
+def used_today(user):
+    """Conversions done today; a row last touched on an earlier day counts as zero."""
+    return user.done_today if user.last_use_date == date.today() else 0
+
+
+class UsageAccounting:
+    """
+    Write-behind counter for done_today / last_use_date.
+    Increments land on the cached User instance immediately (so quota checks
+    stay exact) and reach the database in one UPDATE per distinct increment.
+    """
+
+    def __init__(self, interval=USAGE_FLUSH_INTERVAL):
+        self.interval = interval
+        self.day = date.today()
+        self._pending = defaultdict(int)
+        self._task = None
+
+    def record(self, user):
+        today = date.today()
+        user.done_today = used_today(user) + 1
+        user.last_use_date = today
+        self._pending[(today, user.id)] += 1
+        self._ensure_started()
+
+    def apply_pending(self, user):
+        """Folds unflushed increments into a row just read from the database."""
+        pending = self._pending.get((date.today(), user.id))
+        if pending:
+            user.done_today = used_today(user) + pending
+            user.last_use_date = date.today()
+        return user
+
+    async def flush(self, before=None):
+        """Writes pending increments; with before, only those recorded on earlier days."""
+        keys = [key for key in self._pending if before is None or key[0] < before]
+        if not keys:
+            return
+        pending = {key: self._pending.pop(key) for key in keys}
+
+        groups = defaultdict(list)
+        for (day, uid), amount in pending.items():
+            groups[(day, amount)].append(uid)
+
+        for (day, amount), uids in groups.items():
+            try:
+                # Adds only to a count from the same day; an older one starts
+                # over. A newer day is left alone, so a late or retried flush
+                # never lands on, or winds back, a later day's counter
+                await User.filter(id__in=uids).filter(
+                    Q(last_use_date__isnull=True) | Q(last_use_date__lte=day)
+                ).update(
+                    done_today=Case(When(last_use_date=day, then=F('done_today') + amount), default=amount),
+                    last_use_date=day
+                )
+            except Exception as e:
+                print(f"Usage flush failed, keeping {len(uids)} users pending: {e}")
+                for uid in uids:
+                    self._pending[(day, uid)] += amount
+
+    async def rollover(self):
+        """Flushes the finished day, resets every stale counter in one statement, then flushes today."""
+        today = date.today()
+        await self.flush(before=today)
+        await User.filter(last_use_date__lt=today, done_today__gt=0).update(done_today=0)
+        self.day = today
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if date.today() != self.day:
+                    await self.rollover()
+                else:
+                    await self.flush()
+            except Exception as e:
+                print(f"Usage accounting error: {e}")
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def start(self):
+        await self.rollover()
+        self._ensure_started()
+
+    async def stop(self):
+        """Flushes whatever is still pending; called on graceful shutdown."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if date.today() != self.day:
+            await self.rollover()
+        else:
+            await self.flush()
+
+
+usage = UsageAccounting()
@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import date
+from telethon import types
+from db.database import User
+from core.metrics import counter
+from core.usage import usage
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE') or 10000)
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL') or 300)
+
+cache_requests = counter('user_cache_requests_total', 'User lookups served by the in-process cache, by result')
+
+
+class UserCache:
+    """
+    Bounded LRU of User rows with a TTL.
+    Handlers mutate and save the cached instance, so it stays in sync with
+    what this process writes; the TTL covers writes made elsewhere.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, uid):
+        entry = self._entries.get(uid)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[uid]
+            return None
+        self._entries.move_to_end(uid)
+        return user
+
+    def put(self, user):
+        self._entries[user.id] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, uid):
+        self._entries.pop(uid, None)
+
+    def values(self):
+        return [user for user, _ in self._entries.values()]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache()
+
+
+async def get_user(uid, username=None, first_name='User', access_hash=None):
+    user = user_cache.get(uid)
+    if user is not None:
+        cache_requests.inc(result='hit')
+    else:
+        cache_requests.inc(result='miss')
+        user, _ = await User.get_or_create(
+            id=uid,
+            defaults={'username': username, 'first_name': first_name, 'access_hash': access_hash}
+        )
+        usage.apply_pending(user)
+        user_cache.put(user)
+
+    if access_hash and user.access_hash != access_hash:
+        user.access_hash = access_hash
+        await User.filter(id=uid).update(access_hash=access_hash)
+    return user
+
+
+def sender_access_hash(sender):
+    """'min' users carry an access hash that can't be used to address them."""
+    if sender is None or getattr(sender, 'min', False):
+        return None
+    return getattr(sender, 'access_hash', None)
+
+
+async def register_user(event, remember_peer=True):
+    """
+    Ensures user exists in DB on every interaction.
+    Access hashes are per account, so only the bot (which does all the
+    outbound sends) stores them; the userbot passes remember_peer=False.
+    """
+    sender = await event.get_sender()
+    uid = sender.id if sender else event.sender_id
+    return await get_user(
+        uid,
+        username=getattr(sender, 'username', None),
+        first_name=getattr(sender, 'first_name', 'User'),
+        access_hash=sender_access_hash(sender) if remember_peer else None
+    )
+
+
+def input_peer(user_id, access_hash):
+    """InputPeerUser straight from the DB, falling back to Telethon's entity cache."""
+    if access_hash:
+        return types.InputPeerUser(user_id, access_hash)
+    return user_id
+
+
+async def backfill_access_hashes(client, batch_size=500):
+    """
+    Fills access_hash for rows created before it was tracked, from the
+    entities the bot's session file has already seen. No network calls.
+    """
+    filled = 0
+    after_id = 0
+    while True:
+        rows = await User.filter(id__gt=after_id, access_hash__isnull=True) \
+            .order_by('id').limit(batch_size).only('id', 'access_hash')
+        if not rows:
+            break
+        after_id = rows[-1].id
+
+        found = []
+        for row in rows:
+            try:
+                peer = client.session.get_input_entity(row.id)
+            except (ValueError, TypeError):
+                continue
+            if isinstance(peer, types.InputPeerUser) and peer.access_hash:
+                row.access_hash = peer.access_hash
+                found.append(row)
+
+        if found:
+            await User.bulk_update(found, fields=['access_hash'])
+            filled += len(found)
+        await asyncio.sleep(0)
+
+    print(f"✅ Access hash backfill done: {filled} users updated")
+
+
+def invalidate(uid):
+    user_cache.invalidate(uid)
+
+
+def has_active_subscription(user):
+    return bool(
+        user.is_premium and
+        user.premium_expiry_date and
+        user.premium_expiry_date >= date.today()
+    )
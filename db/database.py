@@ -1,27 +1,195 @@
 import os
+import time
+import functools
 from tortoise import Tortoise, fields
+from tortoise.backends.base.config_generator import generate_config
 from tortoise.models import Model
+from core.metrics import histogram
+
+DB_QUERY_METHODS = ('execute_query', 'execute_query_dict', 'execute_insert', 'execute_many', 'execute_script')
+
+query_latency = histogram('db_query_seconds', 'Database round trips, by client method')
 
 class User(Model):
     id = fields.BigIntField(pk=True)
     username = fields.CharField(max_length=255, null=True)
     first_name = fields.CharField(max_length=255, null=True)
+    # As seen by the bot account, so sends can use InputPeerUser without a lookup
+    access_hash = fields.BigIntField(null=True)
     joined_at = fields.DatetimeField(auto_now_add=True)
     
-    is_premium = fields.BooleanField(default=False)
-    premium_expiry_date = fields.DateField(null=True) 
+    is_premium = fields.BooleanField(default=False, index=True)
+    premium_expiry_date = fields.DateField(null=True, index=True)
+    # Expiry date the last "expiring soon" reminder was sent for
+    premium_notice_for = fields.DateField(null=True)
     
     done_today = fields.IntField(default=0)
-    last_use_date = fields.DateField(null=True)
+    last_use_date = fields.DateField(null=True, index=True)
 
     class Meta:
         table = "users"
 
-async def init_db():
-    db_url = os.getenv('DB_URL', 'sqlite://db.sqlite3')
-    await Tortoise.init(
-        db_url=db_url,
-        modules={'models': ['db.database']}
-    )
+class TranscodeCache(Model):
+    """Round notes we already uploaded, keyed by the incoming Document.id."""
+    id = fields.IntField(pk=True)
+    # Access hashes and file references belong to the account that uploaded them
+    owner = fields.CharField(max_length=16)
+    source_id = fields.BigIntField()
+    content_hash = fields.CharField(max_length=64, null=True, index=True)
+
+    document_id = fields.BigIntField()
+    access_hash = fields.BigIntField()
+    file_reference = fields.BinaryField()
+    message_id = fields.IntField()
+
+    created_at = fields.DatetimeField(auto_now_add=True)
+    last_used_at = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "transcode_cache"
+        unique_together = (("owner", "source_id"),)
+
+class Broadcast(Model):
+    id = fields.IntField(pk=True)
+    admin_id = fields.BigIntField()
+    target = fields.CharField(max_length=16)
+
+    # Content is re-read from the admin chat, so a crashed run can resume
+    source_chat_id = fields.BigIntField()
+    message_ids = fields.JSONField()
+    button_text = fields.CharField(max_length=255, null=True)
+    button_url = fields.CharField(max_length=1024, null=True)
+
+    status = fields.CharField(max_length=16, default="running")  # running / paused / done / cancelled
+    # Last user id handed to the senders; the audience is paged by id after it
+    cursor = fields.BigIntField(default=0)
+    total = fields.IntField(default=0)
+    sent = fields.IntField(default=0)
+    blocked = fields.IntField(default=0)
+    errors = fields.IntField(default=0)
+
+    created_at = fields.DatetimeField(auto_now_add=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "broadcasts"
+
+class BroadcastDelivery(Model):
+    id = fields.IntField(pk=True)
+    broadcast = fields.ForeignKeyField('models.Broadcast', related_name='deliveries', on_delete=fields.CASCADE)
+    user_id = fields.BigIntField()
+    # Inserted as 'pending'; one runner claims a row as 'sending:<token>' just
+    # before its request, then sets sent / blocked / failed. Rows still
+    # pending are picked up by the next run. Claimed rows left by a crash or
+    # an error become 'unknown' and are never retried, so nobody gets it twice
+    status = fields.CharField(max_length=16, default="pending")
+
+    class Meta:
+        table = "broadcast_deliveries"
+        unique_together = (("broadcast", "user_id"),)
+        indexes = (("broadcast", "status"),)
+
+class Payment(Model):
+    """One row per Telegram charge; the unique charge_id makes crediting idempotent."""
+    id = fields.IntField(pk=True)
+    charge_id = fields.CharField(max_length=255, unique=True)
+    provider_charge_id = fields.CharField(max_length=255, null=True)
+    user_id = fields.BigIntField(index=True)
+
+    currency = fields.CharField(max_length=8)
+    amount = fields.BigIntField()
+    payload = fields.CharField(max_length=128)
+    days = fields.IntField()
+    # Premium end date this payment produced, for support lookups
+    expires_on = fields.DateField()
+
+    created_at = fields.DatetimeField(auto_now_add=True, index=True)
+
+    class Meta:
+        table = "payments"
+
+class JobRecord(Model):
+    """One row per video job, for /perf; pruned after JOB_RECORD_RETENTION_DAYS."""
+    id = fields.IntField(pk=True)
+    source = fields.CharField(max_length=16)
+    user_id = fields.BigIntField()
+
+    input_size = fields.BigIntField(null=True)
+    duration = fields.IntField(null=True)
+    width = fields.IntField(null=True)
+    height = fields.IntField(null=True)
+    profile = fields.CharField(max_length=16, null=True)
+    tier = fields.CharField(max_length=8, null=True)  # free / premium
+    qos_level = fields.IntField(null=True)  # see core.qos.LADDER; null when nothing was encoded
+    path = fields.CharField(max_length=16, null=True)  # remux / copy_video / encode / cache
+    streamed = fields.BooleanField(default=False)
+
+    # Stage times in seconds; null when the stage didn't run
+    queue = fields.FloatField(null=True)
+    download = fields.FloatField(null=True)
+    stream = fields.FloatField(null=True)
+    ffmpeg = fields.FloatField(null=True)
+    upload = fields.FloatField(null=True)
+    send = fields.FloatField(null=True)
+    total = fields.FloatField()
+
+    output_size = fields.BigIntField(null=True)
+    outcome = fields.CharField(max_length=16)  # ok / busy / failed
+
+    created_at = fields.DatetimeField(auto_now_add=True, index=True)
+
+    class Meta:
+        table = "job_records"
+
+def instrument(client_class):
+    """Times every query method of a Tortoise client class (and its transaction wrappers)."""
+    for cls in [client_class, *client_class.__subclasses__()]:
+        for name in DB_QUERY_METHODS:
+            method = cls.__dict__.get(name)
+            if method is None or getattr(method, 'instrumented', False):
+                continue
+
+            def timed(method, name):
+                @functools.wraps(method)
+                async def wrapper(self, *args, **kwargs):
+                    started = time.monotonic()
+                    try:
+                        return await method(self, *args, **kwargs)
+                    finally:
+                        query_latency.observe(time.monotonic() - started, method=name)
+                wrapper.instrumented = True
+                return wrapper
+
+            setattr(cls, name, timed(method, name))
+
+async def init_db(migrate=None):
+    """
+    Connects Tortoise and brings the schema up to date (see db/migrations.py).
+    Set DB_AUTO_MIGRATE=0 when migrations are run separately at deploy time.
+    """
+    db_url = os.getenv('DB_URL') or 'sqlite://db.sqlite3'
+    config = generate_config(db_url, app_modules={'models': ['db.database']})
+    credentials = config['connections']['default']['credentials']
+
+    if config['connections']['default']['engine'] == 'tortoise.backends.sqlite':
+        # WAL lets readers run during a write; busy_timeout waits for the lock
+        # instead of failing with "database is locked" when the bot and
+        # userbot processes write at the same time
+        credentials.setdefault('journal_mode', 'WAL')
+        credentials.setdefault('synchronous', 'NORMAL')
+        credentials.setdefault('busy_timeout', int(os.getenv('SQLITE_BUSY_TIMEOUT_MS') or 5000))
+        credentials.setdefault('cache_size', -int(os.getenv('SQLITE_CACHE_KB') or 20000))
+        credentials.setdefault('temp_store', 'MEMORY')
+    else:
+        credentials.setdefault('minsize', int(os.getenv('DB_POOL_MIN') or 1))
+        credentials.setdefault('maxsize', int(os.getenv('DB_POOL_MAX') or 10))
+        credentials.setdefault('max_inactive_connection_lifetime', float(os.getenv('DB_POOL_IDLE_SECONDS') or 300))
+
+    await Tortoise.init(config=config)
+    instrument(type(Tortoise.get_connection('default')))
 
-    await Tortoise.generate_schemas()
\ No newline at end of file
+    if migrate is None:
+        migrate = (os.getenv('DB_AUTO_MIGRATE') or '1') == '1'
+    if migrate:
+        from db.migrations import migrate as run_migrations
+        await run_migrations()
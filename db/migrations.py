@@ -0,0 +1,277 @@
+"""
+Versioned schema migrations.
+Each step runs once, in order, inside a transaction, and is recorded in
+schema_migrations; a database that is already current costs one query.
+Steps are written with IF NOT EXISTS so databases created by the old
+generate_schemas() boot path upgrade in place.
+
+Run by hand with:  python -m db.migrations
+"""
+import asyncio
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+# Column types that differ between the two supported backends
+TYPES = {
+    'sqlite': {
+        'pk': 'INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL',
+        'bigpk': 'INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL',
+        'bool': 'INT',
+        'false': '0',
+        'ts': 'TIMESTAMP',
+        'json': 'JSON',
+        'blob': 'BLOB',
+        'float': 'REAL',
+    },
+    'postgres': {
+        'pk': 'SERIAL NOT NULL PRIMARY KEY',
+        'bigpk': 'BIGSERIAL NOT NULL PRIMARY KEY',
+        'bool': 'BOOL',
+        'false': 'FALSE',
+        'ts': 'TIMESTAMPTZ',
+        'json': 'JSONB',
+        'blob': 'BYTEA',
+        'float': 'DOUBLE PRECISION',
+    },
+}
+
+
+async def add_column(conn, dialect, table, column, ddl):
+    if dialect == 'postgres':
+        await conn.execute_query(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{column}" {ddl}')
+        return
+    _, rows = await conn.execute_query(f'PRAGMA table_info("{table}")')
+    if column not in {row['name'] for row in rows}:
+        await conn.execute_query(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}')
+
+
+async def initial(conn, dialect):
+    await run(conn, dialect, '''
+        CREATE TABLE IF NOT EXISTS "users" (
+            "id" {bigpk},
+            "username" VARCHAR(255),
+            "first_name" VARCHAR(255),
+            "joined_at" {ts} NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "is_premium" {bool} NOT NULL DEFAULT {false},
+            "premium_expiry_date" DATE,
+            "done_today" INT NOT NULL DEFAULT 0,
+            "last_use_date" DATE
+        )
+    ''')
+
+
+async def user_access_hash(conn, dialect):
+    await add_column(conn, dialect, 'users', 'access_hash', 'BIGINT')
+
+
+async def transcode_cache(conn, dialect):
+    await run(conn, dialect, '''
+        CREATE TABLE IF NOT EXISTS "transcode_cache" (
+            "id" {pk},
+            "owner" VARCHAR(16) NOT NULL,
+            "source_id" BIGINT NOT NULL,
+            "content_hash" VARCHAR(64),
+            "document_id" BIGINT NOT NULL,
+            "access_hash" BIGINT NOT NULL,
+            "file_reference" {blob} NOT NULL,
+            "message_id" INT NOT NULL,
+            "created_at" {ts} NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "last_used_at" {ts} NOT NULL,
+            CONSTRAINT "uid_transcode_cache_owner_source" UNIQUE ("owner", "source_id")
+        )
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_transcode_cache_content_hash" ON "transcode_cache" ("content_hash")
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_transcode_cache_last_used_at" ON "transcode_cache" ("last_used_at")
+    ''')
+
+
+async def broadcasts(conn, dialect):
+    await run(conn, dialect, '''
+        CREATE TABLE IF NOT EXISTS "broadcasts" (
+            "id" {pk},
+            "admin_id" BIGINT NOT NULL,
+            "target" VARCHAR(16) NOT NULL,
+            "source_chat_id" BIGINT NOT NULL,
+            "message_ids" {json} NOT NULL,
+            "button_text" VARCHAR(255),
+            "button_url" VARCHAR(1024),
+            "status" VARCHAR(16) NOT NULL DEFAULT 'running',
+            "cursor" BIGINT NOT NULL DEFAULT 0,
+            "total" INT NOT NULL DEFAULT 0,
+            "sent" INT NOT NULL DEFAULT 0,
+            "blocked" INT NOT NULL DEFAULT 0,
+            "errors" INT NOT NULL DEFAULT 0,
+            "created_at" {ts} NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "finished_at" {ts}
+        )
+    ''', '''
+        CREATE TABLE IF NOT EXISTS "broadcast_deliveries" (
+            "id" {pk},
+            "user_id" BIGINT NOT NULL,
+            "status" VARCHAR(16) NOT NULL DEFAULT 'sending',
+            "broadcast_id" INT NOT NULL REFERENCES "broadcasts" ("id") ON DELETE CASCADE,
+            CONSTRAINT "uid_broadcast_deliveries_broadcast_user" UNIQUE ("broadcast_id", "user_id")
+        )
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_broadcast_deliveries_broadcast_status"
+            ON "broadcast_deliveries" ("broadcast_id", "status")
+    ''')
+
+
+async def payments(conn, dialect):
+    await run(conn, dialect, '''
+        CREATE TABLE IF NOT EXISTS "payments" (
+            "id" {pk},
+            "charge_id" VARCHAR(255) NOT NULL UNIQUE,
+            "provider_charge_id" VARCHAR(255),
+            "user_id" BIGINT NOT NULL,
+            "currency" VARCHAR(8) NOT NULL,
+            "amount" BIGINT NOT NULL,
+            "payload" VARCHAR(128) NOT NULL,
+            "days" INT NOT NULL,
+            "expires_on" DATE NOT NULL,
+            "created_at" {ts} NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_payments_user_id" ON "payments" ("user_id")
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_payments_created_at" ON "payments" ("created_at")
+    ''')
+
+
+async def user_indexes(conn, dialect):
+    # Broadcast audiences, expiry sweeps and the daily usage reset filter on these
+    await run(conn, dialect, '''
+        CREATE INDEX IF NOT EXISTS "idx_users_is_premium" ON "users" ("is_premium")
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_users_premium_expiry_date" ON "users" ("premium_expiry_date")
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_users_last_use_date" ON "users" ("last_use_date")
+    ''')
+
+
+async def premium_notice(conn, dialect):
+    await add_column(conn, dialect, 'users', 'premium_notice_for', 'DATE')
+
+
+async def job_records(conn, dialect):
+    await run(conn, dialect, '''
+        CREATE TABLE IF NOT EXISTS "job_records" (
+            "id" {pk},
+            "source" VARCHAR(16) NOT NULL,
+            "user_id" BIGINT NOT NULL,
+            "input_size" BIGINT,
+            "duration" INT,
+            "width" INT,
+            "height" INT,
+            "profile" VARCHAR(16),
+            "path" VARCHAR(16),
+            "streamed" {bool} NOT NULL DEFAULT {false},
+            "queue" {float},
+            "download" {float},
+            "stream" {float},
+            "ffmpeg" {float},
+            "upload" {float},
+            "send" {float},
+            "total" {float} NOT NULL,
+            "output_size" BIGINT,
+            "outcome" VARCHAR(16) NOT NULL,
+            "created_at" {ts} NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_job_records_created_at" ON "job_records" ("created_at")
+    ''')
+
+
+async def job_qos(conn, dialect):
+    await add_column(conn, dialect, 'job_records', 'tier', 'VARCHAR(8)')
+    await add_column(conn, dialect, 'job_records', 'qos_level', 'INT')
+
+
+async def delivery_pending_default(conn, dialect):
+    # Deliveries are recorded as 'pending' and claimed later, not sent on insert
+    if dialect == 'postgres':
+        await conn.execute_query('ALTER TABLE "broadcast_deliveries" ALTER COLUMN "status" SET DEFAULT \'pending\'')
+        return
+    # SQLite can't change a column default in place, so the table is rebuilt
+    await run(conn, dialect, '''
+        CREATE TABLE "broadcast_deliveries_new" (
+            "id" {pk},
+            "user_id" BIGINT NOT NULL,
+            "status" VARCHAR(16) NOT NULL DEFAULT 'pending',
+            "broadcast_id" INT NOT NULL REFERENCES "broadcasts" ("id") ON DELETE CASCADE,
+            CONSTRAINT "uid_broadcast_deliveries_broadcast_user" UNIQUE ("broadcast_id", "user_id")
+        )
+    ''', '''
+        INSERT INTO "broadcast_deliveries_new" ("id", "user_id", "status", "broadcast_id")
+            SELECT "id", "user_id", "status", "broadcast_id" FROM "broadcast_deliveries"
+    ''', '''
+        DROP TABLE "broadcast_deliveries"
+    ''', '''
+        ALTER TABLE "broadcast_deliveries_new" RENAME TO "broadcast_deliveries"
+    ''', '''
+        CREATE INDEX IF NOT EXISTS "idx_broadcast_deliveries_broadcast_status"
+            ON "broadcast_deliveries" ("broadcast_id", "status")
+    ''')
+
+
+# Append only: never edit or reorder a step once it has shipped
+MIGRATIONS = [
+    (1, 'initial', initial),
+    (2, 'users.access_hash', user_access_hash),
+    (3, 'transcode_cache', transcode_cache),
+    (4, 'broadcasts', broadcasts),
+    (5, 'payments', payments),
+    (6, 'users indexes', user_indexes),
+    (7, 'users.premium_notice_for', premium_notice),
+    (8, 'job_records', job_records),
+    (9, 'job_records.tier and qos_level', job_qos),
+    (10, 'broadcast_deliveries.status default', delivery_pending_default),
+]
+
+
+async def run(conn, dialect, *statements):
+    for sql in statements:
+        await conn.execute_query(sql.format(**TYPES[dialect]))
+
+
+def dialect_of(conn):
+    return 'sqlite' if conn.capabilities.dialect == 'sqlite' else 'postgres'
+
+
+async def migrate(connection_name='default'):
+    conn = Tortoise.get_connection(connection_name)
+    dialect = dialect_of(conn)
+
+    await conn.execute_query(
+        'CREATE TABLE IF NOT EXISTS "schema_migrations" ('
+        '"version" INT NOT NULL PRIMARY KEY, '
+        '"name" VARCHAR(255) NOT NULL, '
+        f'"applied_at" {TYPES[dialect]["ts"]} NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    )
+    _, rows = await conn.execute_query('SELECT MAX("version") AS "version" FROM "schema_migrations"')
+    current = rows[0]['version'] or 0
+
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        async with in_transaction(connection_name) as tx:
+            await step(tx, dialect)
+            await tx.execute_query(
+                'INSERT INTO "schema_migrations" ("version", "name") VALUES ({0}, {1})'.format(
+                    *(('?', '?') if dialect == 'sqlite' else ('$1', '$2'))
+                ),
+                [version, name]
+            )
+        print(f"✅ Migration {version} applied: {name}")
+
+
+async def main():
+    from db.database import init_db
+    await init_db(migrate=True)
+    await Tortoise.close_connections()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,38 +1,50 @@
 import os
+import signal
 import asyncio
 from db.database import init_db
-from bot.bot import main as run_bot
-from userbot.userbot import main as run_userbot
+from core.usage import usage
+from core.monitoring import monitor
+from core.scheduler import transcoder
+from core import governor
+from bot.bot import main as run_bot, client as bot_client
+from userbot.userbot import main as run_userbot, client as userbot_client
 
-# --- NEW: Dummy Server for Render ---
-async def handle_client(reader, writer):
-    """Simple HTTP response to keep Render happy."""
-    data = await reader.read(100)
-    message = "HTTP/1.1 200 OK\r\nContent-Length: 7\r\n\r\nI am up"
-    writer.write(message.encode())
-    await writer.drain()
-    writer.close()
-
-async def start_dummy_server():
+async def start_monitoring():
     # Get the PORT from Render, default to 8080 if missing
     port = int(os.getenv("PORT", 8080))
-    server = await asyncio.start_server(
-        handle_client, '0.0.0.0', port
-    )
-    print(f"✅ Dummy server started on port {port}")
-    await server.serve_forever()
-# ------------------------------------
+    monitor.add_check('bot', bot_client.is_connected)
+    monitor.add_check('userbot', userbot_client.is_connected)
+    await monitor.serve('0.0.0.0', port)
 
 async def start_all():
     print("🚀 Initializing Database...")
     await init_db()
+    await usage.start()
+
+    # Render stops instances with SIGTERM; turn it into a cancellation so the
+    # shutdown path below still runs
+    main_task = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    except NotImplementedError:
+        pass
     
     print("🚀 Launching Bots & Server...")
-    await asyncio.gather(
-        run_bot(),
-        run_userbot(),
-        start_dummy_server()
-    )
+    try:
+        await asyncio.gather(
+            run_bot(),
+            run_userbot(),
+            start_monitoring()
+        )
+    finally:
+        print("🛑 Stopping transcoder...")
+        await transcoder.stop()
+        governor.kill_all()
+        print("🛑 Flushing usage counters...")
+        await usage.stop()
 
 if __name__ == "__main__":
-    asyncio.run(start_all())
\ No newline at end of file
+    try:
+        asyncio.run(start_all())
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
@@ -0,0 +1,60 @@
+import asyncio
+from telethon import TelegramClient, functions
+from telethon.errors import FloodWaitError
+from telethon.sessions import StringSession
+from core import broadcast
+
+
+class FloodingSender:
+    """Stands in for the MTProto connection; every request gets a FloodWait."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+
+    def send(self, request, ordered=False):
+        self.calls += 1
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(FloodWaitError(request=request, capture=self.seconds))
+        return future
+
+
+class RecordingBucket:
+    def __init__(self):
+        self.penalties = []
+
+    async def acquire(self):
+        pass
+
+    def penalize(self, seconds):
+        self.penalties.append(seconds)
+
+    def reward(self):
+        pass
+
+
+class Content:
+    request_bytes = 0
+
+    def requests(self, peer):
+        yield functions.messages.SendMessageRequest(peer=peer, message="hi", random_id=broadcast.random_id())
+
+
+def test_flood_wait_reaches_bucket(monkeypatch):
+    async def scenario():
+        # Well under the client's own threshold, which Telethon would otherwise sleep through
+        client = TelegramClient(StringSession(), 1, 'hash', flood_sleep_threshold=60)
+        client._sender = FloodingSender(seconds=5)
+        recording = RecordingBucket()
+        monkeypatch.setattr(broadcast, 'bucket', recording)
+
+        runner = broadcast.BroadcastRunner(client, None)
+        runner.content = Content()
+        status = await asyncio.wait_for(runner._send(1, 2), timeout=2)
+        return status, recording.penalties, client._sender.calls
+
+    status, penalties, calls = asyncio.run(scenario())
+    assert status == 'failed'
+    assert penalties == [5] * broadcast.MAX_ATTEMPTS
+    # Retries are refused by Telethon's own FloodWait cache without a round trip
+    assert calls == 1
@@ -1,15 +1,18 @@
 import os
-import random
 import asyncio
 import time
-import subprocess
-from datetime import date
-from telethon import TelegramClient, events, functions, types
+from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 
 from dotenv import load_dotenv
 
-from db.database import User
+from core.scheduler import QueueFullError, PRIORITY_PREMIUM
+from core import admission, engine, users
+from core.users import register_user
+from core.usage import usage
+from core.ttlstore import TTLStore
+from core.pipeline import NoteJob, run_album
+from core.progress import ProgressReporter
 
 load_dotenv()
 
@@ -26,70 +29,19 @@ if not STRING_SESSION:
 
 client = TelegramClient(StringSession(STRING_SESSION), API_ID, API_HASH)
 
-non_premium_cooldowns = {}
 COOLDOWN_SECONDS = 300  # 5 Minutes
-
-async def register_user(event):
-    """Ensures user exists in DB on every interaction."""
-    sender = await event.get_sender()
-    uid = sender.id if sender else event.sender_id
-    
-    user, _ = await User.get_or_create(
-        id=uid,
-        defaults={
-            'username': getattr(sender, 'username', None), 
-            'first_name': getattr(sender, 'first_name', 'User')
-        }
-    )
-    return user
-
-def process_video_v2(input_path, output_path):
-    """
-    High-performance cropping and resizing using FFmpeg.
-    """
-    command = [
-        'ffmpeg',
-        '-y',
-        '-i', input_path,
-        '-vf', "crop='min(iw,ih):min(iw,ih)',scale=400:400",
-        '-c:v', 'libx264',
-        '-preset', 'medium',
-        '-crf', '20',
-        '-c:a', 'aac',
-        '-b:a', '64k',
-        '-movflags', '+faststart',
-        output_path
-    ]
-
-    try:
-        subprocess.run(
-            command, 
-            check=True, 
-            stdout=subprocess.DEVNULL, 
-            stderr=subprocess.DEVNULL
-        )
-        return True
-    except Exception as e:
-        print(f"FFmpeg Error: {e}")
-        return False
-
+# Entries only matter for the cooldown itself, so they expire with it
+non_premium_cooldowns = TTLStore('userbot_cooldowns', ttl=COOLDOWN_SECONDS, max_size=50000, persist=True)
+CACHE_OWNER = "userbot"
 
 @client.on(events.NewMessage)
 async def main_handler(event):
     if not event.is_private or event.out:
         return
 
-    user = await register_user(event)
+    user = await register_user(event, remember_peer=False)
 
-    is_subscription_active = (
-        user.is_premium and 
-        user.premium_expiry_date and 
-        user.premium_expiry_date >= date.today()
-    )
-
-    if user.is_premium and not is_subscription_active:
-        user.is_premium = False
-        await user.save()
+    is_subscription_active = users.has_active_subscription(user)
 
     if not is_subscription_active:
         now = time.time()
@@ -117,68 +69,92 @@ async def main_handler(event):
             await event.respond(welcome_text)
         return
 
-    if not event.video:
+    # Album videos are handled together by album_handler
+    if not event.video or event.grouped_id:
         return
 
-    duration = 0
-    if hasattr(event.video, 'attributes'):
-        for attr in event.video.attributes:
-            if isinstance(attr, types.DocumentAttributeVideo):
-                duration = attr.duration
-                break
-    
-    if duration > 60:
-        return await event.respond("❌ **Video too long!** Max 60 seconds.")
+    decision = admission.check(event.video, True)
+    if not decision.accepted:
+        return await event.respond(decision.message)
+    duration = decision.duration
 
-    status_msg = await event.respond("⏳ **Processing Premium Note...**")
-    
-    path_in = f"in_{user.id}_{random.randint(1000,9999)}.mp4"
-    path_out = f"out_{user.id}_{random.randint(1000,9999)}.mp4"
+    # Everything reaching the userbot is premium traffic
+    profile = engine.profile_for(True, decision.downscale)
+    progress = ProgressReporter(event, "⏳ **Processing Premium Note...**", duration)
+    job = NoteJob(client, CACHE_OWNER, user.id, event.message, decision, profile, PRIORITY_PREMIUM, progress)
 
     try:
-        await event.download_media(file=path_in)
-        await status_msg.edit("⚙️ **Cropping...**")
-        
-        success = await asyncio.to_thread(process_video_v2, path_in, path_out)
-        
-        if not success or not os.path.exists(path_out):
-            raise Exception("Processing failed")
-
-        await status_msg.edit("⬆️ **Uploading...**")
-        uploaded_file = await client.upload_file(path_out)
-
-        video_attribute = types.DocumentAttributeVideo(
-            duration=duration, 
-            w=400, h=400, 
-            round_message=True 
-        )
+        peer = await event.get_input_chat()
+        await job.prepare()
+        await job.send(peer)
 
-        await client(functions.messages.SendMediaRequest(
-            peer=await event.get_input_chat(),
-            media=types.InputMediaUploadedDocument(
-                file=uploaded_file, 
-                mime_type='video/mp4', 
-                attributes=[video_attribute]
-            ),
-            message=event.message.message or "",
-            entities=event.message.entities,
-            random_id=random.randint(0, 2**63 - 1)
-        ))
-
-        user.done_today += 1
-        user.last_use_date = date.today()
-        await user.save()
-        
-        await status_msg.delete()
+        usage.record(user)
+        job.timer.outcome = 'ok'
+        await progress.finish()
 
+    except QueueFullError:
+        job.timer.outcome = 'busy'
+        await progress.fail("🚦 **Server is busy!** Please try again in a few minutes.")
     except Exception as e:
         print(f"Error processing for {user.id}: {e}")
-        await status_msg.edit("❌ **Error processing video.**")
+        await progress.fail("❌ **Error processing video.**")
+    finally:
+        job.cleanup()
+        if not progress.closed:
+            await progress.finish()
+        await job.timer.save()
+
+@client.on(events.Album)
+async def album_handler(event):
+    """Videos sent as one album: converted in parallel, replies in album order."""
+    if not event.is_private or event.out:
+        return
+    messages = [message for message in event.messages if message.video]
+    if not messages:
+        return
+
+    # main_handler already saw each message and warned non-premium senders
+    user = await register_user(event, remember_peer=False)
+    if not users.has_active_subscription(user):
+        return
+
+    accepted, rejections = [], []
+    for message in messages:
+        decision = admission.check(message.video, True)
+        if decision.accepted:
+            accepted.append((message, decision))
+        elif decision.message not in rejections:
+            rejections.append(decision.message)
+    if rejections:
+        await event.respond("\n\n".join(rejections))
+    if not accepted:
+        return
+
+    progress = ProgressReporter(event, "⏳ **Processing Premium Note...**", count=len(accepted))
+    jobs = [
+        NoteJob(
+            client, CACHE_OWNER, user.id, message, decision,
+            engine.profile_for(True, decision.downscale), PRIORITY_PREMIUM,
+            progress.item(i, decision.duration)
+        )
+        for i, (message, decision) in enumerate(accepted)
+    ]
+
+    try:
+        peer = await event.get_input_chat()
+        sent, busy, failed = await run_album(jobs, peer)
+        for _ in range(sent):
+            usage.record(user)
+
+        if busy:
+            await progress.fail("🚦 **Server is busy!** Please try again in a few minutes.")
+        elif failed:
+            await progress.fail(f"❌ **Error processing {failed} of {len(jobs)} videos.**")
+        else:
+            await progress.finish()
     finally:
-        for p in [path_in, path_out]:
-            if os.path.exists(p):
-                try: os.remove(p)
-                except: pass
+        if not progress.closed:
+            await progress.finish()
 
 async def main():
     print("Initializing Database...")